@@ -5,10 +5,16 @@ Aplicação principal Streamlit
 import streamlit as st
 import uuid
 from datetime import datetime
-from typing import List, Dict
-from providers.base import ModelType, Message
+from typing import List, Dict, Tuple
+from providers.base import ModelType
+from providers.ollama_residency import OllamaResidencyManager
 from utils.history import HistoryManager
 from utils.provider_factory import ProviderFactory
+from utils.compare import CompareTarget, ModelComparison, build_target_messages, summarize_comparison
+from utils.single_flight import SingleFlight
+from utils.profiling import RerunProfiler
+from utils.session_store import SessionStore, create_session_store
+from utils.usage_ledger import MeteredProvider, UsageLedger, QuotaExceededError
 import config
 
 # Configuração da página
@@ -19,21 +25,162 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Perfilamento do rerun: ligado pela configuração ou, se PROFILING_ALLOW_QUERY, por ?profile=1
+profiler = RerunProfiler(
+    enabled=config.Config.PROFILING_ENABLED or (
+        config.Config.PROFILING_ALLOW_QUERY and st.query_params.get("profile") == "1"
+    ),
+    capture=config.Config.PROFILE_CAPTURE
+)
+profiler.start()
+
+
+def format_result_metrics(result: Dict) -> str:
+    """Formata latência, tokens e custo de um resultado de comparação"""
+    usage = result.get("usage") or {}
+    parts = [f"⏱️ {result['latency']:.2f}s"]
+    if result.get("time_to_first_token") is not None:
+        parts.append(f"1º token {result['time_to_first_token']:.2f}s")
+    if usage.get("input_tokens") or usage.get("output_tokens"):
+        parts.append(f"🔢 {usage.get('input_tokens', 0)} → {usage.get('output_tokens', 0)} tokens")
+    parts.append(f"💲 {result.get('cost', 0.0):.4f}")
+    if result.get("coalesced"):
+        parts.append("🔗 compartilhada")
+    return " | ".join(parts)
+
+
+def render_comparison(results: List[Dict]):
+    """Exibe os resultados de uma comparação lado a lado"""
+    columns = st.columns(len(results))
+    for column, result in zip(columns, results):
+        with column:
+            st.markdown(f"**{result['provider']} · {result['model']}**")
+            if result.get("error"):
+                st.error(f"Erro: {result['error']}")
+            else:
+                if result.get("image_url"):
+                    st.image(result["image_url"], caption="Imagem gerada")
+                st.write(result["content"])
+            st.caption(format_result_metrics(result))
+
+
+def render_profile_panel(profiler: RerunProfiler):
+    """Painel do desenvolvedor com o tempo de cada fase do rerun"""
+    total = profiler.finish()
+    recent = st.session_state.setdefault("profile_totals", [])
+    recent.append(total)
+    del recent[:-20]
+    
+    with st.expander(f"🛠️ Perfil do rerun: {total:.3f}s", expanded=False):
+        st.table([
+            {"Fase": name, "Tempo (s)": f"{seconds:.3f}", "Chamadas": count, "%": f"{percent:.1f}"}
+            for name, seconds, count, percent in profiler.breakdown()
+        ])
+        st.caption(
+            f"Últimos {len(recent)} reruns: média {sum(recent) / len(recent):.3f}s, "
+            f"máximo {max(recent):.3f}s"
+        )
+        if profiler.profile_path:
+            st.caption(f"Rerun lento: perfil gravado em {profiler.profile_path}")
+        if config.Config.SINGLE_FLIGHT_ENABLED:
+            st.caption(
+                "A chamada ao upstream roda na thread do single-flight: no perfil capturado, "
+                "a fase \"chamada upstream\" aparece apenas como espera em um Condition"
+            )
+
+
+@st.cache_resource
+def warm_up_ollama() -> OllamaResidencyManager:
+    """Pré-carrega os modelos Ollama uma única vez por processo"""
+    manager = OllamaResidencyManager.shared()
+    manager.warm_up()
+    return manager
+
+
+@st.cache_resource
+def get_session_store() -> SessionStore:
+    """Store de sessões compartilhado pelo processo"""
+    return create_session_store()
+
+
+@st.cache_resource
+def get_history_manager() -> HistoryManager:
+    """Gerenciador de histórico compartilhado pelo processo"""
+    return HistoryManager()
+
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """Ledger de uso compartilhado pelo processo"""
+    return UsageLedger()
+
+
+def resolve_identity() -> Tuple[str, str]:
+    """
+    Usuário e time usados na contabilização de uso e nas cotas
+    
+    Vêm de cabeçalhos definidos pelo proxy de autenticação, que o visitante não
+    controla. Parâmetros da URL só são aceitos com USAGE_TRUST_QUERY_IDENTITY.
+    """
+    user = config.Config.DEFAULT_USER
+    team = config.Config.DEFAULT_TEAM
+    if config.Config.USAGE_TRUST_QUERY_IDENTITY:
+        user = st.query_params.get("user", user)
+        team = st.query_params.get("team", team)
+    
+    headers = st.context.headers
+    if config.Config.USAGE_USER_HEADER and headers.get(config.Config.USAGE_USER_HEADER):
+        user = headers.get(config.Config.USAGE_USER_HEADER)
+    if config.Config.USAGE_TEAM_HEADER and headers.get(config.Config.USAGE_TEAM_HEADER):
+        team = headers.get(config.Config.USAGE_TEAM_HEADER)
+    return user, team
+
+
+def persist_session():
+    """Grava a conversa da sessão no store (a gravação efetiva pode ser adiada)"""
+    session_store.put(st.session_state.session_id, {
+        "owner": current_user,
+        "messages": st.session_state.messages,
+        "interaction_id": st.session_state.interaction_id,
+        "current_model_type": st.session_state.current_model_type.value,
+    })
+
+
+with profiler.phase("inicialização de recursos"):
+    session_store = get_session_store()
+    history_manager = get_history_manager()
+    usage_ledger = get_usage_ledger()
+
+# Identificação para contabilização de uso e cotas
+current_user, current_team = resolve_identity()
+
+# Identifica a sessão pela URL, para que qualquer réplica consiga retomá-la
+if "session_id" not in st.session_state:
+    st.session_state.session_id = st.query_params.get("sid") or str(uuid.uuid4())
+    st.query_params["sid"] = st.session_state.session_id
+
 # Inicializa sessão
+# O estado só é lido do store quando a sessão local ainda não o tem
+# (nova réplica, reinício do processo ou reconexão)
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    with profiler.phase("histórico (E/S)"):
+        stored_state = session_store.get(st.session_state.session_id) or {}
+    # Quem tem o link de uma sessão não a retoma se não for o mesmo usuário:
+    # recebe uma sessão nova. Sem cabeçalho de autenticação todos são DEFAULT_USER.
+    if stored_state and stored_state.get("owner") != current_user:
+        stored_state = {}
+        st.session_state.session_id = str(uuid.uuid4())
+        st.query_params["sid"] = st.session_state.session_id
+    st.session_state.messages = stored_state.get("messages", [])
+    st.session_state.interaction_id = stored_state.get("interaction_id", str(uuid.uuid4()))
+    st.session_state.current_model_type = ModelType(
+        stored_state.get("current_model_type", ModelType.TEXT_COMPLETION.value)
+    )
 
 if "current_provider" not in st.session_state:
     st.session_state.current_provider = None
 
-if "current_model_type" not in st.session_state:
-    st.session_state.current_model_type = ModelType.TEXT_COMPLETION
-
-if "interaction_id" not in st.session_state:
-    st.session_state.interaction_id = str(uuid.uuid4())
-
-if "history_manager" not in st.session_state:
-    st.session_state.history_manager = HistoryManager()
+warm_up_ollama()
 
 # Título e cabeçalho
 st.title("🧠 e-BrAIn.Tech")
@@ -44,7 +191,8 @@ with st.sidebar:
     st.header("⚙️ Configurações")
     
     # Seleção de Provider
-    available_providers = ProviderFactory.get_available_providers()
+    with profiler.phase("descoberta de providers"):
+        available_providers = ProviderFactory.get_available_providers()
     provider_options = [name for name, available in available_providers.items() if available]
     
     if not provider_options:
@@ -57,7 +205,27 @@ with st.sidebar:
         index=0
     )
     
-    st.session_state.current_provider = ProviderFactory.get_provider(selected_provider_name)
+    with profiler.phase("descoberta de providers"):
+        st.session_state.current_provider = ProviderFactory.get_provider(selected_provider_name)
+    
+    # Modo de comparação
+    compare_mode = st.checkbox("⚖️ Modo Comparação", value=False)
+    compare_targets: List[CompareTarget] = []
+    if compare_mode:
+        target_options = {}
+        with profiler.phase("descoberta de providers"):
+            for name in provider_options:
+                for model in ProviderFactory.get_provider(name).list_chat_models():
+                    target = CompareTarget(name, model)
+                    target_options[target.label] = target
+        
+        selected_targets = st.multiselect(
+            "Modelos para comparar",
+            options=list(target_options.keys())
+        )
+        compare_targets = [target_options[label] for label in selected_targets]
+        if len(compare_targets) < 2:
+            st.caption("Selecione ao menos dois modelos para comparar")
     
     # Status dos providers
     st.subheader("Status dos Providers")
@@ -77,9 +245,12 @@ with st.sidebar:
         "🎨 Image Creation": ModelType.IMAGE_CREATION,
     }
     
+    # O índice parte do tipo atual, para que o valor restaurado do store ou de uma
+    # interação do histórico não seja substituído pelo primeiro item da lista
     selected_model_label = st.selectbox(
         "Selecione o tipo de modelo",
-        options=list(model_types.keys())
+        options=list(model_types.keys()),
+        index=list(model_types.values()).index(st.session_state.current_model_type)
     )
     st.session_state.current_model_type = model_types[selected_model_label]
     
@@ -93,23 +264,39 @@ with st.sidebar:
     }
     st.caption(descriptions[st.session_state.current_model_type])
     
+    # Consumo e orçamento
+    st.divider()
+    st.subheader("💰 Consumo")
+    with profiler.phase("contabilização de uso"):
+        spend = usage_ledger.summary(current_user, current_team)
+        budget = usage_ledger.budget_usage(current_user, current_team)
+    st.write(f"Últimas 24h: US$ {spend['day']['user']:.2f} (você) | US$ {spend['day']['team']:.2f} ({current_team})")
+    st.write(f"30 dias: US$ {spend['month']['user']:.2f} (você) | US$ {spend['month']['team']:.2f} ({current_team})")
+    if budget:
+        ratio, scope, window, spent, limit = budget
+        st.progress(min(ratio, 1.0), text=f"Orçamento {scope[0]} ({window}): US$ {spent:.2f} de US$ {limit:.2f}")
+    
     # Histórico
     st.divider()
     st.subheader("📜 Histórico")
     
-    history = st.session_state.history_manager.get_history()
+    with profiler.phase("histórico (E/S)"):
+        history = history_manager.get_history()
+        archived = history_manager.archive.count() if history_manager.archive else None
     st.write(f"Interações salvas: {len(history)}/{config.Config.MAX_HISTORY}")
+    if archived is not None:
+        st.caption(f"Interações arquivadas: {archived}")
     
     if st.button("🔄 Nova Conversa"):
         st.session_state.messages = []
         st.session_state.interaction_id = str(uuid.uuid4())
+        persist_session()
         st.rerun()
     
     if st.button("🗑️ Limpar Histórico"):
-        if st.session_state.history_manager:
-            st.session_state.history_manager.clear_history()
-            st.success("Histórico limpo!")
-            st.rerun()
+        history_manager.clear_history()
+        st.success("Histórico limpo!")
+        st.rerun()
     
     # Lista de interações anteriores
     if history:
@@ -123,17 +310,22 @@ with st.sidebar:
                 st.session_state.messages = interaction['messages']
                 st.session_state.interaction_id = interaction['id']
                 st.session_state.current_model_type = ModelType(interaction['model_type'])
+                persist_session()
                 st.rerun()
 
 # Área principal - Chat
 st.header("💬 Conversa")
 
 # Exibe mensagens
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        if message.get("image_url"):
-            st.image(message["image_url"], caption="Imagem gerada")
-        st.write(message["content"])
+with profiler.phase("renderização"):
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            if message.get("comparison"):
+                render_comparison(message["comparison"])
+                continue
+            if message.get("image_url"):
+                st.image(message["image_url"], caption="Imagem gerada")
+            st.write(message["content"])
 
 # Input do usuário
 if prompt := st.chat_input("Digite sua mensagem..."):
@@ -148,61 +340,156 @@ if prompt := st.chat_input("Digite sua mensagem..."):
     with st.chat_message("user"):
         st.write(prompt)
     
-    # Gera resposta
-    with st.chat_message("assistant"):
-        with st.spinner("Gerando resposta..."):
-            try:
-                # Converte mensagens para formato do provider
-                provider_messages = [
-                    Message(role=msg["role"], content=msg["content"])
-                    for msg in st.session_state.messages
-                ]
-                
-                # Chama o provider
-                provider = st.session_state.current_provider
-                if not provider:
-                    st.error("Provider não selecionado")
-                    st.stop()
-                
-                response = provider.chat_completion(
-                    messages=provider_messages,
-                    model_type=st.session_state.current_model_type
-                )
-                
-                # Exibe resposta
-                if response.get("image_url"):
-                    st.image(response["image_url"], caption="Imagem gerada")
-                
-                assistant_message = {
-                    "role": "assistant",
-                    "content": response.get("content", ""),
-                    "image_url": response.get("image_url"),
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                st.write(assistant_message["content"])
-                st.session_state.messages.append(assistant_message)
-                
-                # Salva no histórico
-                title = st.session_state.messages[0]["content"][:50] if st.session_state.messages else "Nova Conversa"
-                st.session_state.history_manager.add_interaction(
+    # Cotas são verificadas antes de qualquer chamada ao upstream
+    try:
+        usage_ledger.check_quota(current_user, current_team)
+        quota_error = None
+    except QuotaExceededError as e:
+        quota_error = f"Erro: {str(e)}"
+    
+    if quota_error:
+        with st.chat_message("assistant"):
+            st.error(quota_error)
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": quota_error,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    # Gera comparação entre modelos
+    elif compare_mode and len(compare_targets) >= 2:
+        with st.chat_message("assistant"):
+            columns = st.columns(len(compare_targets))
+            placeholders = []
+            for column, target in zip(columns, compare_targets):
+                with column:
+                    st.markdown(f"**{target.label}**")
+                    placeholders.append((st.empty(), st.empty()))
+            
+            # Cada coluna é atualizada à medida que seu modelo responde
+            texts = ["" for _ in compare_targets]
+            results = [None for _ in compare_targets]
+            # O uso é contabilizado pela thread do single-flight, uma vez por chamada ao upstream
+            comparison = ModelComparison(
+                compare_targets,
+                wrap_provider=lambda provider: MeteredProvider(provider, usage_ledger, current_user, current_team)
+            )
+            # Inclui a atualização das colunas, intercalada com a chegada dos deltas
+            with profiler.phase("chamada upstream"):
+                for index, event in comparison.stream(st.session_state.messages, st.session_state.current_model_type):
+                    body, metrics = placeholders[index]
+                    if event.get("delta"):
+                        texts[index] += event["delta"]
+                        body.markdown(texts[index] + "▌")
+                    if event.get("done"):
+                        result = event["result"]
+                        results[index] = result
+                        if result["error"]:
+                            body.error(f"Erro: {result['error']}")
+                        elif result["image_url"]:
+                            with body.container():
+                                st.image(result["image_url"], caption="Imagem gerada")
+                                st.write(result["content"])
+                        else:
+                            body.markdown(result["content"])
+                        metrics.caption(format_result_metrics(result))
+            
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": summarize_comparison(results),
+                "comparison": results,
+                "timestamp": datetime.now().isoformat()
+            })
+            
+            # Salva a comparação como uma única interação no histórico
+            title = st.session_state.messages[0]["content"][:50]
+            with profiler.phase("histórico (E/S)"):
+                history_manager.add_interaction(
                     interaction_id=st.session_state.interaction_id,
                     messages=st.session_state.messages,
-                    provider=selected_provider_name,
+                    provider=", ".join(target.key for target in compare_targets),
                     model_type=st.session_state.current_model_type.value,
                     title=title
                 )
-                
-            except Exception as e:
-                error_msg = f"Erro: {str(e)}"
-                st.error(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg,
-                    "timestamp": datetime.now().isoformat()
-                })
+    
+    # Gera resposta com o provider selecionado
+    else:
+        with st.chat_message("assistant"):
+            with st.spinner("Gerando resposta..."):
+                try:
+                    # Converte mensagens para formato do provider
+                    provider = st.session_state.current_provider
+                    if not provider:
+                        st.error("Provider não selecionado")
+                        st.stop()
+                    
+                    # Perto do limite do orçamento, troca para o modelo mais barato configurado
+                    downgrade_model = usage_ledger.resolve_model(selected_provider_name, current_user, current_team)
+                    if downgrade_model:
+                        st.caption(f"💰 Orçamento próximo do limite: usando {downgrade_model}")
+                    
+                    # Turnos de comparação anteriores viram a resposta que este modelo deu
+                    # (ou a primeira bem-sucedida), e não o resumo da comparação
+                    with profiler.phase("conversão de mensagens"):
+                        provider_messages = build_target_messages(
+                            st.session_state.messages,
+                            f"{selected_provider_name}/{provider.resolve_model(downgrade_model)}"
+                        )
+                    
+                    # Prompts idênticos de outras sessões em andamento compartilham a mesma chamada
+                    # O uso é contabilizado pela thread do single-flight, mesmo que este
+                    # rerun seja interrompido, e só uma vez para sessões que compartilham a chamada
+                    with profiler.phase("chamada upstream"):
+                        response = SingleFlight.shared().chat_completion(
+                            MeteredProvider(provider, usage_ledger, current_user, current_team),
+                            messages=provider_messages,
+                            model_type=st.session_state.current_model_type,
+                            model=downgrade_model
+                        )
+                    
+                    # Exibe resposta
+                    if response.get("image_url"):
+                        st.image(response["image_url"], caption="Imagem gerada")
+                    
+                    assistant_message = {
+                        "role": "assistant",
+                        "content": response.get("content", ""),
+                        "image_url": response.get("image_url"),
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    
+                    st.write(assistant_message["content"])
+                    st.session_state.messages.append(assistant_message)
+                    
+                    # Salva no histórico
+                    title = st.session_state.messages[0]["content"][:50] if st.session_state.messages else "Nova Conversa"
+                    with profiler.phase("histórico (E/S)"):
+                        history_manager.add_interaction(
+                            interaction_id=st.session_state.interaction_id,
+                            messages=st.session_state.messages,
+                            provider=selected_provider_name,
+                            model_type=st.session_state.current_model_type.value,
+                            title=title
+                        )
+                    
+                except Exception as e:
+                    error_msg = f"Erro: {str(e)}"
+                    st.error(error_msg)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": error_msg,
+                        "timestamp": datetime.now().isoformat()
+                    })
+    
+    # Grava a conversa atualizada no store de sessões
+    with profiler.phase("histórico (E/S)"):
+        persist_session()
 
 # Footer
 st.divider()
 st.caption("e-BrAIn.Tech - Portal de CoE de IA | Mantém contexto das interações e armazena as últimas 90 interações")
 
+# Painel do desenvolvedor, renderizado por último para cobrir o rerun inteiro
+if profiler.enabled:
+    render_profile_panel(profiler)
+
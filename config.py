@@ -3,12 +3,24 @@ Configuração centralizada do portal e-BrAIn.Tech
 Todas as variáveis de ambiente são carregadas aqui
 """
 import os
+import json
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Optional, List, Dict, Any
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
 
+def _json_env(name: str, default: Any) -> Any:
+    """Lê uma variável de ambiente em JSON, usando o padrão se ausente ou inválida"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        print(f"Valor JSON inválido em {name}; usando o padrão")
+        return default
+
 class Config:
     """Configurações do portal"""
     
@@ -25,15 +37,92 @@ class Config:
     AWS_SECRET_ACCESS_KEY: Optional[str] = os.getenv("AWS_SECRET_ACCESS_KEY")
     AWS_REGION: str = os.getenv("AWS_REGION", "us-east-1")
     AWS_BEDROCK_MODEL: str = os.getenv("AWS_BEDROCK_MODEL", "anthropic.claude-3-5-sonnet-20240620-v1:0")  # Modelo mais recente: Claude 3.5 Sonnet
+    # Regiões em ordem de preferência para failover (a primeira é a principal)
+    AWS_BEDROCK_REGIONS: List[str] = [
+        region.strip()
+        for region in os.getenv("AWS_BEDROCK_REGIONS", os.getenv("AWS_REGION", "us-east-1")).split(",")
+        if region.strip()
+    ]
+    AWS_BEDROCK_INFERENCE_PROFILE: str = os.getenv("AWS_BEDROCK_INFERENCE_PROFILE", "")  # us, eu ou apac; vazio desativa
+    AWS_BEDROCK_MAX_POOL_CONNECTIONS: int = int(os.getenv("AWS_BEDROCK_MAX_POOL_CONNECTIONS", "50"))
     
     # Ollama
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "llama3.1")  # Modelo mais recente: Llama 3.1
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # Tempo que o modelo fica carregado após o uso
+    OLLAMA_PRELOAD_MODELS: List[str] = [
+        model.strip()
+        for model in os.getenv("OLLAMA_PRELOAD_MODELS", os.getenv("OLLAMA_MODEL", "llama3.1")).split(",")
+        if model.strip()
+    ]
+    OLLAMA_MEMORY_BUDGET_MB: int = int(os.getenv("OLLAMA_MEMORY_BUDGET_MB", "0"))  # 0 = sem limite
+    OLLAMA_EVICT_FOREIGN: bool = os.getenv("OLLAMA_EVICT_FOREIGN", "false").lower() == "true"  # Também descarrega modelos de outros clientes
+    OLLAMA_LOAD_TIMEOUT: int = int(os.getenv("OLLAMA_LOAD_TIMEOUT", "300"))
     
     # Configurações gerais
     MAX_HISTORY: int = int(os.getenv("MAX_HISTORY", "90"))
     HISTORY_FILE: str = os.getenv("HISTORY_FILE", "history.json")
     
+    # Arquivo de histórico: interações além de MAX_HISTORY em segmentos comprimidos
+    HISTORY_ARCHIVE_ENABLED: bool = os.getenv("HISTORY_ARCHIVE_ENABLED", "true").lower() == "true"
+    HISTORY_ARCHIVE_DIR: str = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive")
+    HISTORY_ARCHIVE_BATCH: int = int(os.getenv("HISTORY_ARCHIVE_BATCH", "100"))  # Interações por bloco comprimido
+    HISTORY_ARCHIVE_SEGMENT_MB: int = int(os.getenv("HISTORY_ARCHIVE_SEGMENT_MB", "64"))
+    HISTORY_ARCHIVE_LEVEL: int = int(os.getenv("HISTORY_ARCHIVE_LEVEL", "9"))
+    
+    # Resiliência das chamadas aos providers
+    REQUEST_TIMEOUT: float = float(os.getenv("REQUEST_TIMEOUT", "60"))  # Timeout de cada tentativa (s)
+    REQUEST_DEADLINE: float = float(os.getenv("REQUEST_DEADLINE", "120"))  # Prazo total incluindo retentativas (s)
+    RETRY_MAX_ATTEMPTS: int = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+    RETRY_BASE_DELAY: float = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY: float = float(os.getenv("RETRY_MAX_DELAY", "8"))
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RESET_TIMEOUT: float = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+    
+    # Estado de sessão no servidor (memory, sqlite ou redis)
+    SESSION_STORE: str = os.getenv("SESSION_STORE", "memory")
+    SESSION_STORE_PATH: str = os.getenv("SESSION_STORE_PATH", "sessions.db")
+    SESSION_REDIS_URL: str = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+    SESSION_TTL: int = int(os.getenv("SESSION_TTL", "604800"))  # 7 dias; sessões ociosas expiram (sqlite e redis)
+    SESSION_WRITE_BEHIND_INTERVAL: float = float(os.getenv("SESSION_WRITE_BEHIND_INTERVAL", "1.0"))  # 0 = gravação imediata
+    
+    # Saída estruturada: tentativas de correção quando a resposta não valida no esquema
+    STRUCTURED_MAX_RETRIES: int = int(os.getenv("STRUCTURED_MAX_RETRIES", "2"))
+    
+    # Contabilização de uso e cotas
+    USAGE_DB_PATH: str = os.getenv("USAGE_DB_PATH", "usage.db")
+    USAGE_SYNC_INTERVAL: float = float(os.getenv("USAGE_SYNC_INTERVAL", "30"))
+    DEFAULT_USER: str = os.getenv("DEFAULT_USER", "anonymous")
+    DEFAULT_TEAM: str = os.getenv("DEFAULT_TEAM", "default")
+    # Cabeçalhos com usuário e time definidos pelo proxy de autenticação (ex.: X-Forwarded-User)
+    USAGE_USER_HEADER: str = os.getenv("USAGE_USER_HEADER", "")
+    USAGE_TEAM_HEADER: str = os.getenv("USAGE_TEAM_HEADER", "")
+    # Aceita ?user=/?team= na URL; qualquer visitante pode trocá-los, então só para desenvolvimento
+    USAGE_TRUST_QUERY_IDENTITY: bool = os.getenv("USAGE_TRUST_QUERY_IDENTITY", "false").lower() == "true"
+    # Orçamentos em USD por janela, ex.: {"team:coe": {"month": 500}, "user:*": {"day": 10}}
+    USAGE_BUDGETS: Dict[str, Dict[str, float]] = _json_env("USAGE_BUDGETS", {})
+    # Modelo mais barato por provider, usado quando o gasto passa do limiar
+    USAGE_DOWNGRADE_MODELS: Dict[str, str] = _json_env("USAGE_DOWNGRADE_MODELS", {
+        "OpenAI": "gpt-4o-mini",
+        "Anthropic": "claude-3-5-haiku-20241022",
+        "AWS Bedrock": "anthropic.claude-3-5-haiku-20241022-v1:0",
+    })
+    USAGE_DOWNGRADE_THRESHOLD: float = float(os.getenv("USAGE_DOWNGRADE_THRESHOLD", "0.8"))
+    
+    # Modo de comparação entre modelos
+    COMPARE_MAX_WORKERS: int = int(os.getenv("COMPARE_MAX_WORKERS", "8"))
+    
+    # Coalescência de prompts idênticos em andamento (uma chamada ao upstream por grupo)
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    
+    # Perfilamento dos reruns
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    # Permite ligar o perfilamento por ?profile=1; desligado por padrão, pois grava arquivos no servidor
+    PROFILING_ALLOW_QUERY: bool = os.getenv("PROFILING_ALLOW_QUERY", "false").lower() == "true"
+    PROFILE_CAPTURE: str = os.getenv("PROFILE_CAPTURE", "")  # cprofile, sampling (pyinstrument) ou vazio
+    PROFILE_SLOW_RERUN_SECONDS: float = float(os.getenv("PROFILE_SLOW_RERUN_SECONDS", "2"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+    
     @classmethod
     def validate(cls) -> dict:
         """
@@ -6,15 +6,33 @@ from providers.openai_provider import OpenAIProvider
 from providers.anthropic_provider import AnthropicProvider
 from providers.bedrock_provider import BedrockProvider
 from providers.ollama_provider import OllamaProvider
+from providers.ollama_residency import OllamaResidencyManager
 from providers.base import BaseProvider, ModelType, Message
+from providers.structured import StructuredOutputError
+from providers.resilience import (
+    ProviderError,
+    RetryableProviderError,
+    FatalProviderError,
+    CircuitOpenError,
+    DeadlineExceededError,
+    Deadline,
+)
 
 __all__ = [
     "OpenAIProvider",
     "AnthropicProvider",
     "BedrockProvider",
     "OllamaProvider",
+    "OllamaResidencyManager",
     "BaseProvider",
     "ModelType",
     "Message",
+    "StructuredOutputError",
+    "ProviderError",
+    "RetryableProviderError",
+    "FatalProviderError",
+    "CircuitOpenError",
+    "DeadlineExceededError",
+    "Deadline",
 ]
 
@@ -1,10 +1,11 @@
 """
 Provider para Anthropic (Claude)
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from anthropic import Anthropic
 import config
 from providers.base import BaseProvider, Message, ModelType
+from providers import structured, resilience
 
 class AnthropicProvider(BaseProvider):
     """Provider para Anthropic Claude"""
@@ -13,12 +14,17 @@ class AnthropicProvider(BaseProvider):
         super().__init__("Anthropic")
         self.client = None
         if config.Config.ANTHROPIC_API_KEY:
-            self.client = Anthropic(api_key=config.Config.ANTHROPIC_API_KEY)
+            # As retentativas ficam a cargo da camada de resiliência
+            self.client = Anthropic(api_key=config.Config.ANTHROPIC_API_KEY, max_retries=0)
     
     def is_available(self) -> bool:
         """Verifica se Anthropic está configurado"""
         return self.client is not None
     
+    def default_model(self) -> str:
+        """Modelo configurado em ANTHROPIC_MODEL"""
+        return config.Config.ANTHROPIC_MODEL
+    
     def chat_completion(
         self,
         messages: List[Message],
@@ -35,26 +41,16 @@ class AnthropicProvider(BaseProvider):
                 "content": "Geração de imagens não é suportada pelo Claude. Por favor, use OpenAI para esta funcionalidade."
             }
         
-        system_prompt = self.get_system_prompt(model_type)
-        
-        # Converte mensagens para formato Anthropic
-        anthropic_messages = []
-        for msg in messages:
-            anthropic_messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-        
-        # Ajusta max_tokens baseado no tipo de modelo
-        max_tokens = 2000
-        if model_type == ModelType.SUMMARIZATION:
-            max_tokens = 1000
-        
-        response = self.client.messages.create(
-            model=config.Config.ANTHROPIC_MODEL,
-            max_tokens=max_tokens,
-            system=system_prompt,
-            messages=anthropic_messages
+        model = self.resolve_model(kwargs.get("model"))
+        response = self.call_upstream(
+            lambda timeout: self.client.messages.create(
+                model=model,
+                max_tokens=self.get_max_tokens(model_type),
+                system=self.get_system_prompt(model_type),
+                messages=self._build_messages(messages),
+                timeout=timeout
+            ),
+            kwargs.get("deadline")
         )
         
         # Claude retorna uma lista de blocos de conteúdo
@@ -64,7 +60,117 @@ class AnthropicProvider(BaseProvider):
                 content += block.text
         
         return {
-            "content": content
+            "content": content,
+            "model": model,
+            "usage": self._extract_usage(response.usage)
+        }
+    
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Gera resposta em streaming usando Claude"""
+        if model_type == ModelType.IMAGE_CREATION or not self.is_available():
+            yield from super().stream_completion(messages, model_type, **kwargs)
+            return
+        
+        model = self.resolve_model(kwargs.get("model"))
+        # A conexão é aberta na criação do stream, então só ela passa pelas retentativas
+        stream = self.call_upstream(
+            lambda timeout: self.client.messages.create(
+                model=model,
+                max_tokens=self.get_max_tokens(model_type),
+                system=self.get_system_prompt(model_type),
+                messages=self._build_messages(messages),
+                stream=True,
+                timeout=timeout
+            ),
+            kwargs.get("deadline")
+        )
+        
+        content = ""
+        usage = {}
+        try:
+            for event in stream:
+                if event.type == "message_start":
+                    usage = self._extract_usage(event.message.usage)
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    content += event.delta.text
+                    yield {"delta": event.delta.text}
+                elif event.type == "message_delta":
+                    usage["output_tokens"] = event.usage.output_tokens
+        except Exception as e:
+            raise resilience.wrap_error(self.provider_name, e) from e
+        
+        yield {
+            "done": True,
+            "response": {"content": content, "model": model, "usage": usage}
+        }
+    
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Saída estruturada via tool use com uso obrigatório da ferramenta"""
+        if not self.is_available():
+            raise ValueError("Anthropic não está configurado")
+        
+        model = self.resolve_model(kwargs.get("model"))
+        input_schema, wrapped = structured.wrap_schema(schema)
+        response = self.call_upstream(
+            lambda timeout: self.client.messages.create(
+                model=model,
+                max_tokens=self.get_max_tokens(model_type),
+                system=self.get_system_prompt(model_type),
+                messages=self._build_messages(messages),
+                tools=[{
+                    "name": structured.STRUCTURED_OUTPUT_NAME,
+                    "description": "Registra a resposta no formato estruturado exigido",
+                    "input_schema": input_schema
+                }],
+                tool_choice={"type": "tool", "name": structured.STRUCTURED_OUTPUT_NAME},
+                timeout=timeout
+            ),
+            kwargs.get("deadline")
+        )
+        
+        data = None
+        for block in response.content:
+            if block.type == "tool_use":
+                data = structured.unwrap_data(block.input, wrapped)
+        
+        return {
+            "data": data,
+            "model": model,
+            "usage": self._extract_usage(response.usage)
+        }
+    
+    @staticmethod
+    def _build_messages(messages: List[Message]) -> List[Dict[str, str]]:
+        """Converte mensagens para formato Anthropic"""
+        anthropic_messages = []
+        for msg in messages:
+            anthropic_messages.append({
+                "role": msg.role,
+                "content": msg.content
+            })
+        return anthropic_messages
+    
+    @staticmethod
+    def _extract_usage(usage) -> Dict[str, int]:
+        """Extrai o consumo de tokens da resposta"""
+        if usage is None:
+            return {}
+        return {
+            "input_tokens": usage.input_tokens,
+            "cached_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            "output_tokens": usage.output_tokens
         }
     
     def list_models(self) -> List[str]:
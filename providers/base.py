@@ -3,8 +3,11 @@ Classe base abstrata para todos os providers de LLM
 Cada provider deve implementar esta interface
 """
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterator, Callable, Union
 from enum import Enum
+import json
+import config
+from providers import structured, resilience
 
 class ModelType(Enum):
     """Tipos de modelos disponíveis"""
@@ -51,19 +54,181 @@ class BaseProvider(ABC):
         Args:
             messages: Lista de mensagens da conversa
             model_type: Tipo de modelo a ser usado
-            **kwargs: Parâmetros adicionais específicos do provider
+            **kwargs: Parâmetros adicionais: 'model' (sobrescreve o modelo configurado),
+                'deadline' (prazo total em segundos ou Deadline) e outros específicos do provider
             
         Returns:
-            Dict com 'content' (texto da resposta) e opcionalmente 'image_url' (para geração de imagens)
+            Dict com 'content' (texto da resposta), 'model', 'usage' (tokens consumidos)
+            e opcionalmente 'image_url' (para geração de imagens)
         """
         pass
     
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Gera uma resposta em streaming
+        
+        Emite dicts {"delta": str} à medida que o texto chega e, por último,
+        {"done": True, "response": Dict} com a resposta completa (mesmo formato
+        de chat_completion). Providers sem streaming nativo usam esta
+        implementação, que emite a resposta inteira de uma vez.
+        """
+        response = self.chat_completion(messages, model_type, **kwargs)
+        if response.get("content"):
+            yield {"delta": response["content"]}
+        yield {"done": True, "response": response}
+    
+    def structured_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        max_retries: Optional[int] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Gera uma resposta estruturada validada contra um JSON Schema
+        
+        Usa o mecanismo nativo de cada provider (_structured_request). Quando a
+        validação falha apenas em itens de listas, somente esses itens são
+        pedidos novamente; caso contrário a resposta inteira é refeita.
+        
+        Returns:
+            Dict com 'data' (objeto validado), 'model' e 'usage' (somado entre tentativas)
+            
+        Raises:
+            StructuredOutputError: se a resposta continuar inválida após max_retries
+        """
+        if max_retries is None:
+            max_retries = config.Config.STRUCTURED_MAX_RETRIES
+        # Um único deadline cobre a resposta e todas as correções
+        kwargs["deadline"] = resilience.Deadline.coerce(kwargs.get("deadline"))
+        
+        usage: Dict[str, int] = {}
+        
+        def request(request_messages: List[Message], request_schema: Dict[str, Any]):
+            response = self._structured_request(request_messages, model_type, request_schema, **kwargs)
+            for key, value in response.get("usage", {}).items():
+                usage[key] = usage.get(key, 0) + value
+            data, errors = structured.parse_json(response.get("data"))
+            if errors:
+                # Mantém o texto original para o pedido de correção
+                return response, response.get("data"), errors
+            return response, data, structured.validate(data, request_schema)
+        
+        response, data, errors = request(messages, schema)
+        
+        for _ in range(max_retries):
+            if not errors:
+                break
+            
+            item_paths = structured.failing_items(errors)
+            if item_paths is None:
+                # Erro fora de itens de lista: refaz a resposta inteira
+                _, data, errors = request(
+                    messages + self._repair_messages(data, errors),
+                    schema
+                )
+                continue
+            
+            # Refaz apenas os itens inválidos, mantendo os demais
+            for path in item_paths:
+                item_errors = [(p[len(path):], m) for p, m in errors if p[:len(path)] == path]
+                _, item, item_issues = request(
+                    messages + self._repair_messages(structured.get_at(data, path), item_errors),
+                    structured.schema_at(schema, path)
+                )
+                if not item_issues:
+                    structured.set_at(data, path, item)
+            errors = structured.validate(data, schema)
+        
+        if errors:
+            raise structured.StructuredOutputError(errors, data)
+        
+        return {
+            "data": data,
+            "model": response.get("model"),
+            "usage": usage
+        }
+    
+    @abstractmethod
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Faz uma requisição usando o mecanismo nativo de saída estruturada do provider
+        
+        Returns:
+            Dict com 'data' (objeto já decodificado ou texto JSON), 'model' e 'usage'
+        """
+        pass
+    
+    @staticmethod
+    def _repair_messages(data: Any, errors: List[structured.ValidationIssue]) -> List[Message]:
+        """Monta o pedido de correção de uma resposta inválida"""
+        previous = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        return [
+            Message(role="assistant", content=previous or "{}"),
+            Message(
+                role="user",
+                content=(
+                    "A resposta acima não é válida para o esquema: "
+                    f"{structured.format_errors(errors)}. "
+                    "Responda novamente apenas com o JSON corrigido."
+                )
+            ),
+        ]
+    
     @abstractmethod
     def list_models(self) -> List[str]:
         """Lista os modelos disponíveis para este provider"""
         pass
     
+    def list_chat_models(self) -> List[str]:
+        """Lista apenas os modelos que respondem a chat (usados no modo de comparação)"""
+        return self.list_models()
+    
+    def call_upstream(
+        self,
+        call: Callable[[float], Any],
+        deadline: Union[resilience.Deadline, float, None] = None
+    ) -> Any:
+        """
+        Chama o upstream com retentativas, circuit breaker e deadline
+        
+        Args:
+            call: Função que recebe o timeout da tentativa (em segundos) e faz a chamada
+            deadline: Prazo total (Deadline ou segundos); padrão REQUEST_DEADLINE
+            
+        Raises:
+            ProviderError: erro classificado (RetryableProviderError, FatalProviderError,
+                CircuitOpenError ou DeadlineExceededError)
+        """
+        return resilience.call_with_resilience(self.provider_name, call, deadline)
+    
+    def default_model(self) -> str:
+        """Modelo usado quando a requisição não informa um"""
+        return ""
+    
+    def resolve_model(self, model: Optional[str] = None) -> str:
+        """Modelo efetivo da requisição: o informado ou o padrão configurado do provider"""
+        return model or self.default_model()
+    
     def get_system_prompt(self, model_type: ModelType) -> str:
         """Retorna o prompt do sistema para o tipo de modelo"""
         return self.system_prompts.get(model_type, "You are a helpful AI assistant.")
+    
+    def get_max_tokens(self, model_type: ModelType) -> int:
+        """Retorna o limite de tokens de saída para o tipo de modelo"""
+        if model_type == ModelType.SUMMARIZATION:
+            return 1000
+        return 2000
 
@@ -1,30 +1,124 @@
 """
 Provider para AWS Bedrock
+Usa a API Converse, que unifica o formato de requisição entre as famílias de modelos
 """
-from typing import List, Dict, Any
+import functools
+import math
+import threading
+import time
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 import boto3
-import json
+from botocore.config import Config as BotoConfig
 import config
 from providers.base import BaseProvider, Message, ModelType
+from providers import structured, resilience
+
+# Prefixos geográficos dos perfis de inferência entre regiões
+INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.")
+
+# Regiões atendidas por cada perfil de inferência (geografia do perfil -> prefixo da região)
+PROFILE_REGION_PREFIXES = {"us": "us-", "eu": "eu-", "apac": "ap-"}
+
+# Famílias de modelos que aceitam perfis de inferência entre regiões
+INFERENCE_PROFILE_FAMILIES = ("anthropic.", "meta.", "amazon.nova")
+
+# Modelos que não aceitam prompt de sistema na API Converse
+NO_SYSTEM_PROMPT_FAMILIES = ("amazon.titan-text",)
+
+
+@functools.lru_cache(maxsize=None)
+def profile_regions(regions: Tuple[str, ...], geography: str) -> Tuple[str, ...]:
+    """
+    Regiões que atendem o perfil de inferência da geografia ("us", "eu", "apac")
+    
+    Um perfil "us." chamado em uma região europeia falha com ValidationException,
+    que não é transitória e interromperia o failover. Regiões incompatíveis são
+    descartadas com um aviso (uma vez por configuração); se nenhuma for
+    compatível, a lista é mantida e o erro virá do Bedrock.
+    """
+    prefix = PROFILE_REGION_PREFIXES.get(geography)
+    if prefix is None:
+        return regions
+    matching = tuple(region for region in regions if region.startswith(prefix))
+    mismatched = [region for region in regions if not region.startswith(prefix)]
+    if not matching:
+        print(
+            f"Aviso: nenhuma região em AWS_BEDROCK_REGIONS ({', '.join(regions)}) "
+            f"atende o perfil de inferência '{geography}'"
+        )
+        return regions
+    if mismatched:
+        print(
+            f"Aviso: regiões {', '.join(mismatched)} não atendem o perfil de inferência "
+            f"'{geography}' e não serão usadas com ele"
+        )
+    return matching
+
+
+def timeout_bucket(timeout: float) -> float:
+    """
+    read_timeout do cliente para uma chamada com timeout segundos restantes
+    
+    O timeout cheio (REQUEST_TIMEOUT) é usado como está; abaixo dele, arredonda
+    para baixo em potências de dois (mínimo 1s), para que poucos clientes por
+    região cubram qualquer tempo restante sem ultrapassá-lo.
+    """
+    if timeout >= config.Config.REQUEST_TIMEOUT:
+        return float(config.Config.REQUEST_TIMEOUT)
+    return float(2 ** max(0, int(math.log2(max(timeout, 1)))))
 
 class BedrockProvider(BaseProvider):
     """Provider para AWS Bedrock"""
     
+    # Um cliente por região e read_timeout, compartilhado entre instâncias (o pool de conexões é do cliente)
+    _clients: Dict[Tuple[str, float], Any] = {}
+    _clients_lock = threading.Lock()
+    
     def __init__(self):
         super().__init__("AWS Bedrock")
+        self.regions = config.Config.AWS_BEDROCK_REGIONS
         self.client = None
         if config.Config.AWS_ACCESS_KEY_ID and config.Config.AWS_SECRET_ACCESS_KEY:
-            self.client = boto3.client(
-                'bedrock-runtime',
-                aws_access_key_id=config.Config.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=config.Config.AWS_SECRET_ACCESS_KEY,
-                region_name=config.Config.AWS_REGION
-            )
+            self.client = self._get_client(self.regions[0])
+            if config.Config.AWS_BEDROCK_INFERENCE_PROFILE:
+                # Avisa já na inicialização sobre regiões fora da geografia do perfil
+                profile_regions(tuple(self.regions), config.Config.AWS_BEDROCK_INFERENCE_PROFILE)
+    
+    @classmethod
+    def _get_client(cls, region: str, timeout: Optional[float] = None):
+        """
+        Retorna o cliente bedrock-runtime da região, criando-o na primeira vez
+        O botocore não aceita timeout por chamada: cada faixa de timeout_bucket tem seu cliente
+        """
+        read_timeout = timeout_bucket(timeout if timeout is not None else config.Config.REQUEST_TIMEOUT)
+        key = (region, read_timeout)
+        with cls._clients_lock:
+            if key not in cls._clients:
+                cls._clients[key] = boto3.client(
+                    'bedrock-runtime',
+                    aws_access_key_id=config.Config.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=config.Config.AWS_SECRET_ACCESS_KEY,
+                    region_name=region,
+                    config=BotoConfig(
+                        max_pool_connections=config.Config.AWS_BEDROCK_MAX_POOL_CONNECTIONS,
+                        connect_timeout=min(5, read_timeout),
+                        read_timeout=read_timeout,
+                        # Uma única tentativa: as retentativas ficam a cargo da camada de
+                        # resiliência. O modo adaptativo é mantido só pelo limitador de taxa
+                        # do cliente, que desacelera os envios após throttling
+                        retries={"mode": "adaptive", "total_max_attempts": 1}
+                    )
+                )
+            return cls._clients[key]
     
     def is_available(self) -> bool:
         """Verifica se AWS Bedrock está configurado"""
         return self.client is not None
     
+    def default_model(self) -> str:
+        """Modelo configurado em AWS_BEDROCK_MODEL"""
+        return config.Config.AWS_BEDROCK_MODEL
+    
     def chat_completion(
         self,
         messages: List[Message],
@@ -41,54 +135,196 @@ class BedrockProvider(BaseProvider):
                 "content": "Geração de imagens não é suportada pelo AWS Bedrock. Por favor, use OpenAI para esta funcionalidade."
             }
         
-        system_prompt = self.get_system_prompt(model_type)
+        model = self.resolve_model(kwargs.get("model"))
+        response = self._converse(
+            "converse",
+            self._build_request(messages, model_type, model),
+            kwargs.get("deadline")
+        )
+        
+        # Extrai o conteúdo da resposta
+        content = ""
+        for block in response['output']['message']['content']:
+            if 'text' in block:
+                content += block['text']
         
-        # Converte mensagens para formato Bedrock (Anthropic Claude)
-        # Bedrock usa formato similar ao Anthropic
+        return {
+            "content": content,
+            "model": model,
+            "usage": self._extract_usage(response.get('usage', {}))
+        }
+    
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Gera resposta em streaming usando ConverseStream"""
+        if model_type == ModelType.IMAGE_CREATION or not self.is_available():
+            yield from super().stream_completion(messages, model_type, **kwargs)
+            return
+        
+        model = self.resolve_model(kwargs.get("model"))
+        response = self._converse(
+            "converse_stream",
+            self._build_request(messages, model_type, model),
+            kwargs.get("deadline")
+        )
+        
+        content = ""
+        usage = {}
+        try:
+            for event in response['stream']:
+                if 'contentBlockDelta' in event:
+                    delta = event['contentBlockDelta']['delta'].get('text', '')
+                    if delta:
+                        content += delta
+                        yield {"delta": delta}
+                elif 'metadata' in event:
+                    usage = self._extract_usage(event['metadata'].get('usage', {}))
+        except Exception as e:
+            raise resilience.wrap_error(self.provider_name, e) from e
+        
+        yield {
+            "done": True,
+            "response": {"content": content, "model": model, "usage": usage}
+        }
+    
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Saída estruturada via toolConfig com uso obrigatório da ferramenta"""
+        if not self.is_available():
+            raise ValueError("AWS Bedrock não está configurado")
+        
+        model = self.resolve_model(kwargs.get("model"))
+        input_schema, wrapped = structured.wrap_schema(schema)
+        request = self._build_request(messages, model_type, model)
+        request["toolConfig"] = {
+            "tools": [{
+                "toolSpec": {
+                    "name": structured.STRUCTURED_OUTPUT_NAME,
+                    "description": "Registra a resposta no formato estruturado exigido",
+                    "inputSchema": {"json": input_schema}
+                }
+            }],
+            "toolChoice": {"tool": {"name": structured.STRUCTURED_OUTPUT_NAME}}
+        }
+        response = self._converse("converse", request, kwargs.get("deadline"))
+        
+        data = None
+        for block in response['output']['message']['content']:
+            if 'toolUse' in block:
+                data = structured.unwrap_data(block['toolUse'].get('input'), wrapped)
+        
+        return {
+            "data": data,
+            "model": model,
+            "usage": self._extract_usage(response.get('usage', {}))
+        }
+    
+    @staticmethod
+    def resolve_model_id(model: str) -> str:
+        """
+        Aplica o perfil de inferência entre regiões configurado (ex.: "us.anthropic...")
+        O próprio Bedrock distribui essas requisições entre as regiões do perfil
+        """
+        prefix = config.Config.AWS_BEDROCK_INFERENCE_PROFILE
+        if not prefix or model.startswith(INFERENCE_PROFILE_PREFIXES) or model.startswith("arn:"):
+            return model
+        if model.startswith(INFERENCE_PROFILE_FAMILIES):
+            return f"{prefix}.{model}"
+        return model
+    
+    def _build_request(self, messages: List[Message], model_type: ModelType, model: str) -> Dict[str, Any]:
+        """Monta a requisição Converse, no mesmo formato para todas as famílias de modelos"""
+        system_prompt = self.get_system_prompt(model_type)
         formatted_messages = []
         for msg in messages:
             formatted_messages.append({
                 "role": msg.role,
-                "content": [{"type": "text", "text": msg.content}]
+                "content": [{"text": msg.content}]
             })
         
-        # Ajusta max_tokens baseado no tipo de modelo
-        max_tokens = 2000
-        if model_type == ModelType.SUMMARIZATION:
-            max_tokens = 1000
+        request = {
+            "modelId": self.resolve_model_id(model),
+            "messages": formatted_messages,
+            "inferenceConfig": {
+                "maxTokens": self.get_max_tokens(model_type),
+                "temperature": 0.7
+            }
+        }
         
-        # Prepara o body para Bedrock
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "system": system_prompt,
-            "messages": formatted_messages
-        })
+        # Titan não aceita prompt de sistema: ele vai no início da primeira mensagem
+        if model.startswith(NO_SYSTEM_PROMPT_FAMILIES):
+            if formatted_messages:
+                first = formatted_messages[0]["content"][0]
+                first["text"] = f"{system_prompt}\n\n{first['text']}"
+        else:
+            request["system"] = [{"text": system_prompt}]
         
-        try:
-            response = self.client.invoke_model(
-                modelId=config.Config.AWS_BEDROCK_MODEL,
-                body=body
-            )
-            
-            response_body = json.loads(response['body'].read())
-            
-            # Extrai o conteúdo da resposta
-            content = ""
-            for block in response_body.get('content', []):
-                if block.get('type') == 'text':
-                    content += block.get('text', '')
-            
-            return {
-                "content": content
-            }
-        except Exception as e:
-            raise ValueError(f"Erro ao chamar AWS Bedrock: {str(e)}")
+        return request
+    
+    def _converse(
+        self,
+        operation: str,
+        request: Dict[str, Any],
+        deadline: Optional[resilience.Deadline] = None
+    ) -> Dict[str, Any]:
+        """
+        Chama converse/converse_stream com failover entre as regiões configuradas
+        
+        Se uma região responder com erro transitório (throttling, indisponibilidade),
+        a mesma tentativa segue para a próxima região, desde que ainda haja tempo
+        na tentativa e no deadline; caso contrário o erro volta para a camada de
+        resiliência, que decide sobre o backoff. Cada região recebe como
+        read_timeout o tempo que resta da tentativa (em faixas, veja
+        timeout_bucket). No streaming, o read_timeout limita a espera entre
+        eventos, não a duração total da resposta.
+        """
+        deadline = resilience.Deadline.coerce(deadline)
+        regions = self.regions
+        model_id = request["modelId"]
+        if model_id.startswith(INFERENCE_PROFILE_PREFIXES):
+            regions = list(profile_regions(tuple(self.regions), model_id.split(".", 1)[0]))
+        
+        def call(timeout: float) -> Dict[str, Any]:
+            attempt_ends = time.monotonic() + timeout
+            last_error: Optional[Exception] = None
+            for region in regions:
+                remaining = attempt_ends - time.monotonic()
+                if last_error is not None and (deadline.expired or remaining <= 0):
+                    break
+                try:
+                    return getattr(self._get_client(region, remaining), operation)(**request)
+                except Exception as e:
+                    if not resilience.is_retryable(e):
+                        raise
+                    last_error = e
+            raise last_error
+        
+        return self.call_upstream(call, deadline)
+    
+    @staticmethod
+    def _extract_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+        """Extrai o consumo de tokens da resposta"""
+        return {
+            "input_tokens": usage.get('inputTokens', 0),
+            "cached_tokens": usage.get('cacheReadInputTokens', 0),
+            "cache_write_tokens": usage.get('cacheWriteInputTokens', 0),
+            "output_tokens": usage.get('outputTokens', 0)
+        }
     
     def list_models(self) -> List[str]:
         """Lista modelos AWS Bedrock disponíveis"""
         return [
-            "anthropic.claude-3-5-sonnet-20240620-v2:0",  # Modelo mais recente: Claude 3.5 Sonnet
+            "anthropic.claude-3-5-sonnet-20241022-v2:0",  # Modelo mais recente: Claude 3.5 Sonnet v2
+            "anthropic.claude-3-5-sonnet-20240620-v1:0",  # Claude 3.5 Sonnet (junho 2024)
             "anthropic.claude-3-5-haiku-20241022-v1:0",   # Claude 3.5 Haiku (outubro 2024)
             "anthropic.claude-3-opus-20240229-v1:0",     # Claude 3 Opus
             "anthropic.claude-3-sonnet-20240229-v1:0",   # Claude 3 Sonnet
@@ -1,10 +1,13 @@
 """
 Provider para Ollama (LLMs locais)
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+import json
 import requests
 import config
 from providers.base import BaseProvider, Message, ModelType
+from providers.ollama_residency import OllamaResidencyManager
+from providers import resilience
 
 class OllamaProvider(BaseProvider):
     """Provider para Ollama"""
@@ -12,6 +15,7 @@ class OllamaProvider(BaseProvider):
     def __init__(self):
         super().__init__("Ollama")
         self.base_url = config.Config.OLLAMA_BASE_URL
+        self.residency = OllamaResidencyManager.shared()
     
     def is_available(self) -> bool:
         """Verifica se Ollama está disponível"""
@@ -21,6 +25,10 @@ class OllamaProvider(BaseProvider):
         except:
             return False
     
+    def default_model(self) -> str:
+        """Modelo configurado em OLLAMA_MODEL"""
+        return config.Config.OLLAMA_MODEL
+    
     def chat_completion(
         self,
         messages: List[Message],
@@ -37,8 +45,112 @@ class OllamaProvider(BaseProvider):
                 "content": "Geração de imagens não é suportada pelo Ollama. Por favor, use OpenAI para esta funcionalidade."
             }
         
-        system_prompt = self.get_system_prompt(model_type)
+        model = self.resolve_model(kwargs.get("model"))
+        payload = self._build_payload(messages, model_type, model, stream=False)
+        
+        result = self._post_chat(payload, kwargs.get("deadline")).json()
+        self.residency.touch(model)
+        return {
+            "content": result.get("message", {}).get("content", ""),
+            "model": model,
+            "usage": self._extract_usage(result)
+        }
+    
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Gera resposta em streaming usando Ollama"""
+        if model_type == ModelType.IMAGE_CREATION:
+            yield from super().stream_completion(messages, model_type, **kwargs)
+            return
+        if not self.is_available():
+            raise ValueError("Ollama não está disponível. Certifique-se de que o serviço está rodando.")
+        
+        model = self.resolve_model(kwargs.get("model"))
+        payload = self._build_payload(messages, model_type, model, stream=True)
+        
+        response = self._post_chat(payload, kwargs.get("deadline"), stream=True)
+        
+        # Ollama envia um objeto JSON por linha
+        content = ""
+        usage = {}
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                delta = chunk.get("message", {}).get("content", "")
+                if delta:
+                    content += delta
+                    yield {"delta": delta}
+                if chunk.get("done"):
+                    usage = self._extract_usage(chunk)
+        except Exception as e:
+            raise resilience.wrap_error(self.provider_name, e) from e
+        self.residency.touch(model)
+        
+        yield {
+            "done": True,
+            "response": {"content": content, "model": model, "usage": usage}
+        }
+    
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Saída estruturada via parâmetro format com JSON Schema"""
+        if not self.is_available():
+            raise ValueError("Ollama não está disponível. Certifique-se de que o serviço está rodando.")
+        
+        model = self.resolve_model(kwargs.get("model"))
+        payload = self._build_payload(messages, model_type, model, stream=False)
+        payload["format"] = schema
+        payload["options"] = {"temperature": 0}
         
+        result = self._post_chat(payload, kwargs.get("deadline")).json()
+        self.residency.touch(model)
+        return {
+            "data": result.get("message", {}).get("content", ""),
+            "model": model,
+            "usage": self._extract_usage(result)
+        }
+    
+    def _post_chat(
+        self,
+        payload: Dict[str, Any],
+        deadline: Optional[resilience.Deadline] = None,
+        stream: bool = False
+    ) -> requests.Response:
+        """Envia o payload para /api/chat através da camada de resiliência"""
+        # Libera memória antes da carga do modelo, não depois da resposta
+        self.residency.make_room(payload["model"])
+        
+        def call(timeout: float) -> requests.Response:
+            response = requests.post(
+                f"{self.base_url}/api/chat",
+                json=payload,
+                timeout=timeout,
+                stream=stream
+            )
+            response.raise_for_status()
+            return response
+        
+        return self.call_upstream(call, deadline)
+    
+    def _build_payload(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        model: str,
+        stream: bool
+    ) -> Dict[str, Any]:
+        """Prepara o payload para Ollama"""
         # Converte mensagens para formato Ollama
         formatted_messages = []
         for msg in messages:
@@ -47,30 +159,23 @@ class OllamaProvider(BaseProvider):
                 "content": msg.content
             })
         
-        # Prepara o payload para Ollama
-        payload = {
-            "model": config.Config.OLLAMA_MODEL,
+        return {
+            "model": model,
             "messages": [
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": self.get_system_prompt(model_type)},
                 *formatted_messages
             ],
-            "stream": False
+            "stream": stream,
+            "keep_alive": self.residency.keep_alive
+        }
+    
+    @staticmethod
+    def _extract_usage(result: Dict[str, Any]) -> Dict[str, int]:
+        """Extrai o consumo de tokens da resposta final do Ollama"""
+        return {
+            "input_tokens": result.get("prompt_eval_count", 0),
+            "output_tokens": result.get("eval_count", 0)
         }
-        
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json=payload,
-                timeout=60
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            return {
-                "content": result.get("message", {}).get("content", "")
-            }
-        except Exception as e:
-            raise ValueError(f"Erro ao chamar Ollama: {str(e)}")
     
     def list_models(self) -> List[str]:
         """Lista modelos Ollama disponíveis"""
@@ -96,4 +201,8 @@ class OllamaProvider(BaseProvider):
             "qwen2.5",            # Qwen 2.5 (mais recente)
             "neural-chat"         # Neural Chat
         ]
+    
+    def list_chat_models(self) -> List[str]:
+        """Lista os modelos Ollama de chat (modelos de embeddings ficam de fora)"""
+        return [model for model in self.list_models() if "embed" not in model]
 
@@ -0,0 +1,248 @@
+"""
+Gerenciamento de residência de modelos do Ollama
+Pré-carrega modelos na inicialização e mantém o uso de memória dentro do orçamento
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Union
+import requests
+import config
+
+
+def parse_keep_alive(value: str) -> Union[str, int]:
+    """
+    Converte o keep_alive configurado para o formato da API do Ollama
+    Aceita durações ("30m", "1h") ou segundos ("300", "-1" mantém indefinidamente)
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def keep_alive_seconds(value: Union[str, int]) -> float:
+    """
+    Duração do keep_alive em segundos ("30m" -> 1800, "1h30m" -> 5400)
+    Valores negativos mantêm o modelo indefinidamente (infinito); formato desconhecido vale 0
+    """
+    if isinstance(value, int):
+        return float("inf") if value < 0 else float(value)
+    value = value.strip()
+    if value.startswith("-"):
+        return float("inf")
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return 0.0
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def normalize_model_name(model: str) -> str:
+    """Normaliza o nome do modelo como o Ollama reporta ("llama3.1" -> "llama3.1:latest")"""
+    return model if ":" in model else f"{model}:latest"
+
+
+class OllamaResidencyManager:
+    """
+    Controla quais modelos ficam carregados na memória do Ollama
+    
+    O Ollama descarrega modelos ociosos e a primeira requisição depois disso paga
+    o tempo de carga. Este gerenciador pré-carrega os modelos configurados, envia
+    o keep_alive em cada requisição e, antes de carregar um modelo que não está
+    na memória, descarrega os modelos usados há mais tempo (LRU) até que o novo
+    caiba no orçamento de memória.
+    
+    Só são descarregados os modelos que este processo usou; modelos carregados
+    por outros clientes do mesmo Ollama ficam de fora, a menos que evict_foreign
+    (OLLAMA_EVICT_FOREIGN) esteja ligado.
+    """
+    
+    _shared: Optional["OllamaResidencyManager"] = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        keep_alive: Optional[str] = None,
+        memory_budget_mb: Optional[int] = None,
+        evict_foreign: Optional[bool] = None
+    ):
+        self.base_url = base_url or config.Config.OLLAMA_BASE_URL
+        self.keep_alive = parse_keep_alive(keep_alive or config.Config.OLLAMA_KEEP_ALIVE)
+        self.keep_alive_seconds = keep_alive_seconds(self.keep_alive)
+        if memory_budget_mb is None:
+            memory_budget_mb = config.Config.OLLAMA_MEMORY_BUDGET_MB
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        if evict_foreign is None:
+            evict_foreign = config.Config.OLLAMA_EVICT_FOREIGN
+        self.evict_foreign = evict_foreign
+        # Último uso (time.monotonic) de cada modelo; o primeiro item é o menos usado recentemente
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+        # Tamanho em disco de cada modelo, segundo /api/tags
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Serializa as verificações de espaço para que duas cargas não contem com a mesma folga
+        self._load_lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls) -> "OllamaResidencyManager":
+        """Retorna a instância compartilhada pelo processo"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+    
+    def loaded_models(self) -> Dict[str, Dict]:
+        """
+        Retorna os modelos carregados no momento, via /api/ps
+        Cada item contém 'size' e 'size_vram' em bytes
+        """
+        try:
+            response = requests.get(f"{self.base_url}/api/ps", timeout=2)
+            response.raise_for_status()
+            models = response.json().get("models", [])
+            return {model.get("name", ""): model for model in models}
+        except Exception:
+            return {}
+    
+    def model_size(self, model: str) -> int:
+        """Tamanho do modelo em bytes, via /api/tags (0 se desconhecido)"""
+        model = normalize_model_name(model)
+        with self._lock:
+            if model in self._sizes:
+                return self._sizes[model]
+        try:
+            response = requests.get(f"{self.base_url}/api/tags", timeout=2)
+            response.raise_for_status()
+            sizes = {
+                normalize_model_name(item.get("name", "")): item.get("size", 0)
+                for item in response.json().get("models", [])
+            }
+        except Exception:
+            return 0
+        with self._lock:
+            self._sizes = sizes
+        return sizes.get(model, 0)
+    
+    def make_room(self, model: str) -> List[str]:
+        """
+        Chamado antes de cada requisição: se o modelo ainda não está carregado,
+        descarrega modelos LRU até que ele caiba no orçamento de memória.
+        Retorna os modelos descarregados.
+        
+        Um modelo usado por este processo dentro do keep_alive ainda está
+        carregado: nesse caso não há consulta ao /api/ps nem espera pelo lock.
+        """
+        if self.memory_budget <= 0:
+            return []
+        with self._lock:
+            last_used = self._last_used.get(normalize_model_name(model))
+        if last_used is not None and time.monotonic() - last_used < self.keep_alive_seconds:
+            return []
+        with self._load_lock:
+            loaded = self.loaded_models()
+            if normalize_model_name(model) in loaded:
+                return []
+            return self.enforce_budget(reserve=self.model_size(model), loaded=loaded)
+    
+    def preload(self, model: str) -> bool:
+        """Carrega um modelo na memória sem gerar resposta"""
+        self.make_room(model)
+        try:
+            # Uma requisição sem prompt apenas carrega o modelo
+            response = requests.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive},
+                timeout=config.Config.OLLAMA_LOAD_TIMEOUT
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Erro ao pré-carregar modelo Ollama {model}: {e}")
+            return False
+        
+        self.touch(model)
+        return True
+    
+    def unload(self, model: str) -> bool:
+        """Descarrega um modelo da memória"""
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": 0},
+                timeout=10
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Erro ao descarregar modelo Ollama {model}: {e}")
+            return False
+        
+        with self._lock:
+            self._last_used.pop(normalize_model_name(model), None)
+        return True
+    
+    def warm_up(self, models: Optional[List[str]] = None) -> threading.Thread:
+        """
+        Pré-carrega os modelos em segundo plano
+        Por padrão usa OLLAMA_PRELOAD_MODELS
+        """
+        models = models if models is not None else config.Config.OLLAMA_PRELOAD_MODELS
+        
+        def _run():
+            for model in models:
+                self.preload(model)
+        
+        thread = threading.Thread(target=_run, name="ollama-warm-up", daemon=True)
+        thread.start()
+        return thread
+    
+    def touch(self, model: str):
+        """Registra o uso de um modelo e aplica o orçamento de memória"""
+        model = normalize_model_name(model)
+        with self._lock:
+            self._last_used.pop(model, None)
+            self._last_used[model] = time.monotonic()
+        self.enforce_budget(keep=model)
+    
+    def enforce_budget(
+        self,
+        keep: Optional[str] = None,
+        reserve: int = 0,
+        loaded: Optional[Dict[str, Dict]] = None
+    ) -> List[str]:
+        """
+        Descarrega modelos, do menos para o mais recentemente usado, até que o
+        total carregado, somado a reserve bytes de um modelo prestes a ser
+        carregado, caiba no orçamento. Retorna os modelos descarregados.
+        
+        Sem evict_foreign, apenas modelos usados por este processo são
+        descarregados, mesmo que o orçamento continue estourado.
+        """
+        if self.memory_budget <= 0:
+            return []
+        
+        if loaded is None:
+            loaded = self.loaded_models()
+        total = sum(model.get("size", 0) for model in loaded.values()) + reserve
+        if total <= self.memory_budget:
+            return []
+        
+        with self._lock:
+            order = [name for name in self._last_used if name in loaded]
+            if self.evict_foreign:
+                # Modelos carregados por outros clientes não têm uso registrado e saem primeiro
+                order = [name for name in loaded if name not in self._last_used] + order
+        
+        evicted = []
+        for name in order:
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            if self.unload(name):
+                total -= loaded[name].get("size", 0)
+                evicted.append(name)
+        return evicted
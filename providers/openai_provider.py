@@ -1,10 +1,25 @@
 """
 Provider para OpenAI (GPT-4o, GPT-4 Turbo, DALL-E, Whisper)
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from openai import OpenAI
 import config
 from providers.base import BaseProvider, Message, ModelType
+from providers import structured, resilience
+
+# Modelos de imagem, áudio e embeddings não respondem a chat
+NON_CHAT_MODEL_PREFIXES = ("dall-e", "whisper", "tts", "text-embedding")
+
+# Modelos que aceitam response_format com JSON Schema; os demais (gpt-4-turbo,
+# gpt-4, gpt-3.5-turbo) usam uma chamada de função obrigatória
+JSON_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+JSON_SCHEMA_UNSUPPORTED_MODELS = ("gpt-4o-2024-05-13", "o1-preview", "o1-mini")
+
+
+def supports_json_schema(model: str) -> bool:
+    """Indica se o modelo aceita response_format do tipo json_schema"""
+    return model.startswith(JSON_SCHEMA_MODEL_PREFIXES) and not model.startswith(JSON_SCHEMA_UNSUPPORTED_MODELS)
+
 
 class OpenAIProvider(BaseProvider):
     """Provider para OpenAI"""
@@ -13,12 +28,17 @@ class OpenAIProvider(BaseProvider):
         super().__init__("OpenAI")
         self.client = None
         if config.Config.OPENAI_API_KEY:
-            self.client = OpenAI(api_key=config.Config.OPENAI_API_KEY)
+            # As retentativas ficam a cargo da camada de resiliência
+            self.client = OpenAI(api_key=config.Config.OPENAI_API_KEY, max_retries=0)
     
     def is_available(self) -> bool:
         """Verifica se OpenAI está configurado"""
         return self.client is not None
     
+    def default_model(self) -> str:
+        """Modelo configurado em OPENAI_MODEL"""
+        return config.Config.OPENAI_MODEL
+    
     def chat_completion(
         self,
         messages: List[Message],
@@ -35,43 +55,176 @@ class OpenAIProvider(BaseProvider):
             if not last_message:
                 raise ValueError("Prompt necessário para geração de imagem")
             
-            response = self.client.images.generate(
-                model="dall-e-3",
-                prompt=last_message.content,
-                n=1,
-                size="1024x1024"
+            response = self.call_upstream(
+                lambda timeout: self.client.images.generate(
+                    model="dall-e-3",
+                    prompt=last_message.content,
+                    n=1,
+                    size="1024x1024",
+                    timeout=timeout
+                ),
+                kwargs.get("deadline")
             )
             
             return {
                 "content": f"Imagem gerada baseada em: \"{last_message.content}\"",
-                "image_url": response.data[0].url
+                "image_url": response.data[0].url,
+                "model": "dall-e-3",
+                "usage": {"images": 1}
             }
         
         # Chat completion
-        system_prompt = self.get_system_prompt(model_type)
+        model = self.resolve_model(kwargs.get("model"))
+        response = self.call_upstream(
+            lambda timeout: self.client.chat.completions.create(
+                model=model,
+                messages=self._build_messages(messages, model_type),
+                max_tokens=self.get_max_tokens(model_type),
+                temperature=0.7,
+                timeout=timeout
+            ),
+            kwargs.get("deadline")
+        )
         
-        # Converte mensagens para formato OpenAI
-        openai_messages = [{"role": "system", "content": system_prompt}]
+        return {
+            "content": response.choices[0].message.content,
+            "model": model,
+            "usage": self._extract_usage(response.usage)
+        }
+    
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """Gera resposta em streaming usando OpenAI"""
+        # Geração de imagens não tem streaming
+        if model_type == ModelType.IMAGE_CREATION or not self.is_available():
+            yield from super().stream_completion(messages, model_type, **kwargs)
+            return
+        
+        model = self.resolve_model(kwargs.get("model"))
+        stream = self.call_upstream(
+            lambda timeout: self.client.chat.completions.create(
+                model=model,
+                messages=self._build_messages(messages, model_type),
+                max_tokens=self.get_max_tokens(model_type),
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout
+            ),
+            kwargs.get("deadline")
+        )
+        
+        content = ""
+        usage = {}
+        try:
+            for chunk in stream:
+                # O último chunk traz apenas o uso de tokens, sem choices
+                if chunk.usage:
+                    usage = self._extract_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    content += delta
+                    yield {"delta": delta}
+        except Exception as e:
+            raise resilience.wrap_error(self.provider_name, e) from e
+        
+        yield {
+            "done": True,
+            "response": {"content": content, "model": model, "usage": usage}
+        }
+    
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Saída estruturada via response_format com JSON Schema ou, nos modelos
+        que não o aceitam, via chamada obrigatória de função
+        """
+        if not self.is_available():
+            raise ValueError("OpenAI não está configurado")
+        
+        model = self.resolve_model(kwargs.get("model"))
+        request_schema, wrapped = structured.wrap_schema(schema)
+        use_json_schema = supports_json_schema(model)
+        if use_json_schema:
+            output_format = {
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": structured.STRUCTURED_OUTPUT_NAME,
+                        "schema": request_schema
+                    }
+                }
+            }
+        else:
+            output_format = {
+                "tools": [{
+                    "type": "function",
+                    "function": {
+                        "name": structured.STRUCTURED_OUTPUT_NAME,
+                        "description": "Registra a resposta no formato estruturado exigido",
+                        "parameters": request_schema
+                    }
+                }],
+                "tool_choice": {
+                    "type": "function",
+                    "function": {"name": structured.STRUCTURED_OUTPUT_NAME}
+                }
+            }
+        response = self.call_upstream(
+            lambda timeout: self.client.chat.completions.create(
+                model=model,
+                messages=self._build_messages(messages, model_type),
+                max_tokens=self.get_max_tokens(model_type),
+                temperature=0,
+                timeout=timeout,
+                **output_format
+            ),
+            kwargs.get("deadline")
+        )
+        
+        message = response.choices[0].message
+        if use_json_schema:
+            raw = message.content
+        else:
+            raw = message.tool_calls[0].function.arguments if message.tool_calls else message.content
+        data, errors = structured.parse_json(raw)
+        return {
+            "data": raw if errors else structured.unwrap_data(data, wrapped),
+            "model": model,
+            "usage": self._extract_usage(response.usage)
+        }
+    
+    def _build_messages(self, messages: List[Message], model_type: ModelType) -> List[Dict[str, str]]:
+        """Converte mensagens para formato OpenAI"""
+        openai_messages = [{"role": "system", "content": self.get_system_prompt(model_type)}]
         for msg in messages:
             openai_messages.append({
                 "role": msg.role,
                 "content": msg.content
             })
-        
-        # Ajusta max_tokens baseado no tipo de modelo
-        max_tokens = 2000
-        if model_type == ModelType.SUMMARIZATION:
-            max_tokens = 1000
-        
-        response = self.client.chat.completions.create(
-            model=config.Config.OPENAI_MODEL,
-            messages=openai_messages,
-            max_tokens=max_tokens,
-            temperature=0.7
-        )
-        
+        return openai_messages
+    
+    @staticmethod
+    def _extract_usage(usage) -> Dict[str, int]:
+        """Extrai o consumo de tokens da resposta"""
+        if usage is None:
+            return {}
+        # prompt_tokens inclui os tokens lidos do cache, que são cobrados à parte
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
         return {
-            "content": response.choices[0].message.content
+            "input_tokens": usage.prompt_tokens - cached_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens": usage.completion_tokens
         }
     
     def list_models(self) -> List[str]:
@@ -85,4 +238,8 @@ class OpenAIProvider(BaseProvider):
             "dall-e-3",            # Geração de imagens
             "whisper-1"            # Speech-to-text
         ]
+    
+    def list_chat_models(self) -> List[str]:
+        """Lista os modelos OpenAI de chat"""
+        return [model for model in self.list_models() if not model.startswith(NON_CHAT_MODEL_PREFIXES)]
 
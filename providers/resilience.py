@@ -0,0 +1,276 @@
+"""
+Camada de resiliência compartilhada pelos providers
+Classificação de erros, retentativas com backoff e jitter, circuit breaker e deadline
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar, Union
+import config
+
+T = TypeVar("T")
+
+# Códigos HTTP que indicam falha transitória do upstream
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Códigos de erro do AWS que indicam falha transitória
+RETRYABLE_AWS_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "RequestTimeout",
+}
+
+# Exceções de rede/timeout dos SDKs, identificadas pelo nome para não importar todos eles
+RETRYABLE_EXCEPTION_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "ChunkedEncodingError",
+    "EndpointConnectionError",
+    "ConnectTimeoutError",
+    "ReadTimeoutError",
+}
+
+
+class ProviderError(ValueError):
+    """Erro ao chamar um provider (herda de ValueError por compatibilidade)"""
+    def __init__(self, message: str, provider: str = "", retryable: bool = False):
+        super().__init__(message)
+        self.provider = provider
+        self.retryable = retryable
+
+
+class RetryableProviderError(ProviderError):
+    """Falha transitória que persistiu após as retentativas"""
+    def __init__(self, message: str, provider: str = ""):
+        super().__init__(message, provider, retryable=True)
+
+
+class FatalProviderError(ProviderError):
+    """Falha que não se resolve com nova tentativa (credenciais, requisição inválida...)"""
+    def __init__(self, message: str, provider: str = ""):
+        super().__init__(message, provider, retryable=False)
+
+
+class CircuitOpenError(ProviderError):
+    """O circuit breaker do provider está aberto e a chamada nem foi feita"""
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(
+            f"{provider} indisponível após falhas consecutivas; nova tentativa em {retry_in:.0f}s",
+            provider,
+            retryable=True
+        )
+        self.retry_in = retry_in
+
+
+class DeadlineExceededError(ProviderError):
+    """O tempo total da requisição, somando as retentativas, se esgotou"""
+    def __init__(self, provider: str, deadline: float):
+        super().__init__(f"{provider} não respondeu dentro do prazo de {deadline:.0f}s", provider, retryable=True)
+
+
+class Deadline:
+    """Prazo total de uma requisição, propagado entre retentativas e chamadas encadeadas"""
+    
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self) -> float:
+        """Segundos restantes (nunca negativo)"""
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    @classmethod
+    def coerce(cls, value: Union["Deadline", float, None]) -> "Deadline":
+        """Aceita um Deadline, segundos ou None (usa REQUEST_DEADLINE)"""
+        if isinstance(value, Deadline):
+            return value
+        return cls(value if value is not None else config.Config.REQUEST_DEADLINE)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por provider
+    
+    Após failure_threshold falhas transitórias seguidas o circuito abre e as
+    chamadas falham imediatamente com CircuitOpenError. Passado reset_timeout,
+    uma única chamada de teste é liberada (meio-aberto): sucesso fecha o
+    circuito, falha o reabre. Erros fatais não alteram a contagem; no teste,
+    apenas liberam a próxima chamada para testar de novo.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    
+    _breakers: Dict[str, "CircuitBreaker"] = {}
+    _registry_lock = threading.Lock()
+    
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_provider(cls, name: str) -> "CircuitBreaker":
+        """Retorna o circuit breaker compartilhado do provider"""
+        with cls._registry_lock:
+            if name not in cls._breakers:
+                cls._breakers[name] = cls(
+                    name,
+                    config.Config.CIRCUIT_FAILURE_THRESHOLD,
+                    config.Config.CIRCUIT_RESET_TIMEOUT
+                )
+            return cls._breakers[name]
+    
+    def allow(self):
+        """Libera a chamada ou lança CircuitOpenError"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and elapsed >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return
+            # Aberto, ou meio-aberto com a chamada de teste em andamento
+            raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - elapsed))
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+    
+    def release_probe(self):
+        """Encerra a chamada de teste sem veredito: a próxima chamada testa de novo"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """Extrai o status HTTP de exceções do openai, anthropic, requests ou botocore"""
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status
+    if isinstance(response, dict):
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Classifica a exceção como transitória (vale tentar de novo) ou fatal"""
+    if isinstance(exc, ProviderError):
+        return exc.retryable
+    
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code in RETRYABLE_AWS_ERROR_CODES:
+            return True
+    
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    
+    return any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(exc).__mro__)
+
+
+def wrap_error(provider: str, exc: Exception) -> ProviderError:
+    """Converte uma exceção qualquer no ProviderError correspondente"""
+    if isinstance(exc, ProviderError):
+        return exc
+    message = f"Erro ao chamar {provider}: {exc}"
+    if is_retryable(exc):
+        return RetryableProviderError(message, provider)
+    return FatalProviderError(message, provider)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Lê o cabeçalho Retry-After, quando o upstream informa quanto esperar"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, exc: Optional[Exception] = None) -> float:
+    """Backoff exponencial com jitter completo, respeitando Retry-After"""
+    ceiling = min(config.Config.RETRY_MAX_DELAY, config.Config.RETRY_BASE_DELAY * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    retry_after = _retry_after(exc) if exc is not None else None
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call_with_resilience(
+    provider: str,
+    call: Callable[[float], T],
+    deadline: Union[Deadline, float, None] = None
+) -> T:
+    """
+    Executa call(timeout) com retentativas, circuit breaker e deadline
+    
+    O timeout passado a cada tentativa é o menor entre REQUEST_TIMEOUT e o
+    tempo restante do deadline. Não tenta de novo se a espera do backoff
+    ultrapassar o deadline.
+    """
+    deadline = Deadline.coerce(deadline)
+    breaker = CircuitBreaker.for_provider(provider)
+    max_attempts = max(1, config.Config.RETRY_MAX_ATTEMPTS)
+    
+    for attempt in range(max_attempts):
+        if deadline.expired:
+            raise DeadlineExceededError(provider, deadline.seconds)
+        breaker.allow()
+        
+        try:
+            result = call(min(config.Config.REQUEST_TIMEOUT, deadline.remaining()))
+        except Exception as e:
+            error = wrap_error(provider, e)
+            if not error.retryable:
+                # Erros fatais são do chamador: não indicam upstream doente nem saudável
+                breaker.release_probe()
+                raise error from e
+            breaker.record_failure()
+            
+            delay = backoff_delay(attempt, e)
+            if attempt == max_attempts - 1 or delay >= deadline.remaining():
+                raise error from e
+            time.sleep(delay)
+            continue
+        
+        breaker.record_success()
+        return result
+    
+    raise DeadlineExceededError(provider, deadline.seconds)
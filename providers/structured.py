@@ -0,0 +1,181 @@
+"""
+Validação de saída estruturada (JSON Schema)
+Usa o jsonschema quando instalado e um validador interno simplificado caso contrário
+"""
+import json
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+try:
+    import jsonschema
+except ImportError:  # Dependência opcional
+    jsonschema = None
+
+# Caminho até o valor inválido, ex.: ("findings", 3, "line")
+Path = Tuple[Union[str, int], ...]
+ValidationIssue = Tuple[Path, str]
+
+# Nome da ferramenta/esquema usado nos mecanismos nativos dos providers
+STRUCTURED_OUTPUT_NAME = "structured_output"
+
+# Chave usada para embrulhar esquemas cuja raiz não é um objeto
+WRAPPED_VALUE_KEY = "value"
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+class StructuredOutputError(ValueError):
+    """Resposta que continua inválida após esgotar as tentativas de correção"""
+    def __init__(self, errors: List[ValidationIssue], data: Any):
+        self.errors = errors
+        self.data = data
+        super().__init__("Resposta estruturada inválida: " + format_errors(errors))
+
+
+@lru_cache(maxsize=64)
+def _compiled_validator(schema_json: str):
+    """Compila e mantém em cache o validador do jsonschema para o esquema"""
+    schema = json.loads(schema_json)
+    validator_class = jsonschema.validators.validator_for(schema)
+    return validator_class(schema)
+
+
+def validate(data: Any, schema: Dict[str, Any]) -> List[ValidationIssue]:
+    """Valida os dados contra o esquema e retorna a lista de problemas encontrados"""
+    if jsonschema is not None:
+        validator = _compiled_validator(json.dumps(schema, sort_keys=True))
+        return [
+            (tuple(error.absolute_path), error.message)
+            for error in validator.iter_errors(data)
+        ]
+    return _validate_basic(data, schema, ())
+
+
+def _validate_basic(data: Any, schema: Dict[str, Any], path: Path) -> List[ValidationIssue]:
+    """Validador interno: cobre type, enum, required, properties, items e limites numéricos"""
+    errors: List[ValidationIssue] = []
+    
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_TYPE_CHECKS.get(t, lambda v: True)(data) for t in types):
+            return [(path, f"{data!r} não é do tipo {expected}")]
+    
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append((path, f"{data!r} não está entre {schema['enum']}"))
+    
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        if "minimum" in schema and data < schema["minimum"]:
+            errors.append((path, f"{data} é menor que {schema['minimum']}"))
+        if "maximum" in schema and data > schema["maximum"]:
+            errors.append((path, f"{data} é maior que {schema['maximum']}"))
+    
+    if isinstance(data, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in data:
+                errors.append((path, f"'{name}' é obrigatório"))
+        for name, value in data.items():
+            if name in properties:
+                errors.extend(_validate_basic(value, properties[name], path + (name,)))
+            elif schema.get("additionalProperties") is False:
+                errors.append((path, f"propriedade adicional '{name}' não permitida"))
+    
+    if isinstance(data, list) and isinstance(schema.get("items"), dict):
+        for index, item in enumerate(data):
+            errors.extend(_validate_basic(item, schema["items"], path + (index,)))
+    
+    return errors
+
+
+def parse_json(raw: Any) -> Tuple[Any, List[ValidationIssue]]:
+    """Converte o texto retornado pelo modelo em JSON, tolerando blocos ```json"""
+    if not isinstance(raw, str):
+        return raw, []
+    
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError as e:
+        return None, [((), f"JSON inválido: {e}")]
+
+
+def failing_items(errors: List[ValidationIssue]) -> Optional[List[Path]]:
+    """
+    Agrupa os erros pelos itens de lista onde ocorreram
+    
+    Retorna o caminho de cada item inválido (até o índice, inclusive) ou None
+    quando algum erro está fora de um item de lista, caso em que a resposta
+    inteira precisa ser refeita.
+    """
+    paths: List[Path] = []
+    for path, _ in errors:
+        index = next((i for i, part in enumerate(path) if isinstance(part, int)), None)
+        if index is None:
+            return None
+        item_path = path[:index + 1]
+        if item_path not in paths:
+            paths.append(item_path)
+    return paths
+
+
+def schema_at(schema: Dict[str, Any], path: Path) -> Dict[str, Any]:
+    """Retorna o subesquema que descreve o valor no caminho informado"""
+    for part in path:
+        if isinstance(part, int):
+            schema = schema.get("items", {})
+        else:
+            schema = schema.get("properties", {}).get(part, {})
+    return schema
+
+
+def get_at(data: Any, path: Path) -> Any:
+    """Retorna o valor no caminho informado"""
+    for part in path:
+        data = data[part]
+    return data
+
+
+def set_at(data: Any, path: Path, value: Any):
+    """Substitui o valor no caminho informado"""
+    get_at(data, path[:-1])[path[-1]] = value
+
+
+def wrap_schema(schema: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """
+    Garante que a raiz do esquema seja um objeto
+    Ferramentas (OpenAI, Anthropic, Bedrock) só aceitam objetos na raiz
+    """
+    if schema.get("type") == "object":
+        return schema, False
+    wrapped = {
+        "type": "object",
+        "properties": {WRAPPED_VALUE_KEY: schema},
+        "required": [WRAPPED_VALUE_KEY],
+    }
+    return wrapped, True
+
+
+def unwrap_data(data: Any, wrapped: bool) -> Any:
+    """Desfaz o embrulho aplicado por wrap_schema"""
+    if wrapped and isinstance(data, dict):
+        return data.get(WRAPPED_VALUE_KEY)
+    return data
+
+
+def format_errors(errors: List[ValidationIssue]) -> str:
+    """Formata os erros de validação para mensagens e prompts de correção"""
+    return "; ".join(
+        f"{'/'.join(str(part) for part in path) or '(raiz)'}: {message}"
+        for path, message in errors
+    )
@@ -2,7 +2,10 @@
 Módulo de utilitários
 """
 from utils.history import HistoryManager
+from utils.history_archive import HistoryArchive
 from utils.provider_factory import ProviderFactory
+from utils.single_flight import SingleFlight
+from utils.usage_ledger import MeteredProvider, UsageLedger
 
-__all__ = ["HistoryManager", "ProviderFactory"]
+__all__ = ["HistoryManager", "HistoryArchive", "ProviderFactory", "SingleFlight", "MeteredProvider", "UsageLedger"]
 
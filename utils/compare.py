@@ -0,0 +1,184 @@
+"""
+Modo de comparação entre modelos
+Envia o mesmo prompt para vários pares provider/modelo em paralelo
+"""
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from providers.base import BaseProvider, Message, ModelType
+from utils.provider_factory import ProviderFactory
+from utils.pricing import estimate_cost
+from utils.single_flight import SingleFlight
+import config
+
+
+class CompareTarget:
+    """Par provider/modelo participante de uma comparação"""
+    def __init__(self, provider_name: str, model: str):
+        self.provider_name = provider_name
+        self.model = model
+    
+    @property
+    def key(self) -> str:
+        """Identificador único do par"""
+        return f"{self.provider_name}/{self.model}"
+    
+    @property
+    def label(self) -> str:
+        """Rótulo exibido na interface"""
+        return f"{self.provider_name} · {self.model}"
+
+
+class ModelComparison:
+    """
+    Executa uma comparação entre modelos
+    
+    Cada alvo roda em sua própria thread, de modo que o tempo total é o do
+    modelo mais lento e não a soma de todos. Os eventos de streaming são
+    entregues por uma fila para a thread chamadora, que é a única que pode
+    atualizar a interface do Streamlit.
+    
+    on_response(alvo, resposta) é chamado uma vez por chamada efetiva ao
+    upstream (não para respostas compartilhadas por outra sessão), a partir da
+    thread do single-flight. wrap_provider(provider) permite envolver o provider
+    de cada alvo antes da chamada (por exemplo, em um MeteredProvider).
+    """
+    
+    def __init__(
+        self,
+        targets: List[CompareTarget],
+        on_response: Optional[Callable[[CompareTarget, Dict[str, Any]], None]] = None,
+        wrap_provider: Optional[Callable[[BaseProvider], BaseProvider]] = None
+    ):
+        self.targets = targets
+        self.on_response = on_response
+        self.wrap_provider = wrap_provider
+        self.max_workers = max(1, min(len(targets), config.Config.COMPARE_MAX_WORKERS))
+    
+    def stream(
+        self,
+        messages: List[Dict],
+        model_type: ModelType
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Executa a comparação emitindo (índice do alvo, evento)
+        
+        Eventos: {"delta": str} durante a geração e {"done": True, "result": Dict}
+        ao final de cada alvo (inclusive em caso de erro). Fechar o gerador antes
+        do fim não bloqueia: alvos em andamento terminam em segundo plano.
+        """
+        events: queue.Queue = queue.Queue()
+        
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for index, target in enumerate(self.targets):
+                target_messages = build_target_messages(messages, target.key)
+                executor.submit(self._run_target, index, target, target_messages, model_type, events)
+            
+            pending = len(self.targets)
+            while pending:
+                index, event = events.get()
+                if event.get("done"):
+                    pending -= 1
+                yield index, event
+        finally:
+            # Quem abandona o gerador (rerun, st.stop) não espera os alvos em andamento;
+            # os que ainda não começaram são cancelados
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def run(self, messages: List[Dict], model_type: ModelType) -> List[Dict[str, Any]]:
+        """Executa a comparação e retorna os resultados na ordem dos alvos"""
+        results: List[Dict[str, Any]] = [{} for _ in self.targets]
+        for index, event in self.stream(messages, model_type):
+            if event.get("done"):
+                results[index] = event["result"]
+        return results
+    
+    def _run_target(
+        self,
+        index: int,
+        target: CompareTarget,
+        messages: List[Message],
+        model_type: ModelType,
+        events: queue.Queue
+    ):
+        """Executa um alvo, publicando deltas e o resultado final na fila"""
+        result = {
+            "key": target.key,
+            "provider": target.provider_name,
+            "model": target.model,
+            "content": "",
+            "image_url": None,
+            "usage": {},
+            "cost": 0.0,
+            "latency": None,
+            "time_to_first_token": None,
+            "error": None,
+            "coalesced": False,
+        }
+        started = time.perf_counter()
+        
+        try:
+            provider = ProviderFactory.get_provider(target.provider_name)
+            if not provider:
+                raise ValueError(f"Provider desconhecido: {target.provider_name}")
+            if self.wrap_provider:
+                provider = self.wrap_provider(provider)
+            
+            # Outra sessão comparando o mesmo prompt no mesmo modelo compartilha a chamada
+            on_response = None
+            if self.on_response:
+                on_response = lambda response: self.on_response(target, response)
+            for event in SingleFlight.shared().stream(
+                provider, messages, model_type, on_response, model=target.model
+            ):
+                if event.get("delta"):
+                    if result["time_to_first_token"] is None:
+                        result["time_to_first_token"] = time.perf_counter() - started
+                    events.put((index, {"delta": event["delta"]}))
+                if event.get("done"):
+                    response = event["response"]
+                    result["content"] = response.get("content", "")
+                    result["image_url"] = response.get("image_url")
+                    result["usage"] = response.get("usage", {})
+                    result["coalesced"] = response.get("coalesced", False)
+                    result["cost"] = estimate_cost(response.get("model", target.model), result["usage"])
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            result["latency"] = time.perf_counter() - started
+            events.put((index, {"done": True, "result": result}))
+
+
+def build_target_messages(messages: List[Dict], target_key: str) -> List[Message]:
+    """
+    Converte a conversa para o formato dos providers do ponto de vista de um alvo
+    
+    Mensagens de comparação anteriores são substituídas pela resposta que o
+    próprio alvo deu, para que cada modelo mantenha o seu contexto. Um alvo que
+    não participou (ou falhou) recebe a primeira resposta bem-sucedida; o resumo
+    da comparação só é mantido quando todos falharam, para preservar a
+    alternância de papéis.
+    """
+    provider_messages = []
+    for msg in messages:
+        content = msg["content"]
+        if msg.get("comparison"):
+            successful = [r for r in msg["comparison"] if not r.get("error")]
+            own = [r for r in successful if r.get("key") == target_key]
+            if own or successful:
+                content = (own or successful)[0]["content"]
+        provider_messages.append(Message(role=msg["role"], content=content))
+    return provider_messages
+
+
+def summarize_comparison(results: List[Dict[str, Any]]) -> str:
+    """Gera o texto resumido de uma comparação, usado como conteúdo da mensagem"""
+    lines = []
+    for result in results:
+        if result.get("error"):
+            lines.append(f"{result['provider']} · {result['model']}: erro")
+        else:
+            lines.append(f"{result['provider']} · {result['model']}: {result['latency']:.1f}s")
+    return "Comparação entre modelos — " + "; ".join(lines)
@@ -1,19 +1,50 @@
 """
 Gerenciamento de histórico de interações
-Armazena as últimas 90 interações
+Armazena as últimas 90 interações; as mais antigas vão para o arquivo comprimido
 """
 import json
 import os
-from typing import List, Dict, Optional
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Iterator
 from datetime import datetime
+from utils.history_archive import HistoryArchive
 import config
 
+try:
+    import fcntl
+except ImportError:  # Windows: apenas o lock entre threads do processo
+    fcntl = None
+
 class HistoryManager:
-    """Gerencia o histórico de interações"""
+    """
+    Gerencia o histórico de interações
+    
+    Alterações no arquivo (ler, modificar e gravar) são serializadas por um lock
+    entre threads e, onde houver fcntl, por um flock em HISTORY_FILE.lock, que
+    também coordena réplicas com volume local em comum (flock em NFS não é
+    confiável). A gravação é atômica: leitores nunca veem um arquivo parcial.
+    """
     
     def __init__(self):
         self.history_file = config.Config.HISTORY_FILE
         self.max_history = config.Config.MAX_HISTORY
+        self.archive = HistoryArchive() if config.Config.HISTORY_ARCHIVE_ENABLED else None
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Acesso exclusivo ao arquivo de histórico durante ler-modificar-gravar"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.history_file + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
     
     def _load_history(self) -> List[Dict]:
         """Carrega o histórico do arquivo"""
@@ -27,10 +58,13 @@ class HistoryManager:
             return []
     
     def _save_history(self, history: List[Dict]):
-        """Salva o histórico no arquivo"""
+        """Salva o histórico no arquivo (via arquivo temporário e os.replace)"""
+        temp_path = f"{self.history_file}.{os.getpid()}.tmp"
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
+            # JSON compacto: a indentação multiplicava o tamanho do arquivo
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, self.history_file)
         except Exception as e:
             print(f"Erro ao salvar histórico: {e}")
     
@@ -43,6 +77,18 @@ class HistoryManager:
         title: str
     ):
         """Adiciona uma nova interação ao histórico"""
+        with self._locked():
+            self._add_interaction(interaction_id, messages, provider, model_type, title)
+    
+    def _add_interaction(
+        self,
+        interaction_id: str,
+        messages: List[Dict],
+        provider: str,
+        model_type: str,
+        title: str
+    ):
+        """Ler-modificar-gravar de add_interaction; chamado com o lock do arquivo"""
         history = self._load_history()
         
         interaction = {
@@ -60,10 +106,17 @@ class HistoryManager:
         # Adiciona no início
         history.insert(0, interaction)
         
-        # Mantém apenas as últimas MAX_HISTORY interações
+        # Mantém apenas as últimas MAX_HISTORY interações; as demais vão para o arquivo
+        evicted = history[self.max_history:]
         history = history[:self.max_history]
         
         self._save_history(history)
+        
+        if evicted and self.archive:
+            try:
+                self.archive.archive(evicted)
+            except Exception as e:
+                print(f"Erro ao arquivar histórico: {e}")
     
     def get_history(self) -> List[Dict]:
         """Retorna todo o histórico"""
@@ -75,9 +128,45 @@ class HistoryManager:
         for interaction in history:
             if interaction["id"] == interaction_id:
                 return interaction
+        if self.archive:
+            return self.archive.get_interaction(interaction_id)
         return None
     
+    def iter_all(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Percorre todo o histórico (arquivo e histórico principal), do mais antigo ao mais recente
+        since/until são timestamps ISO opcionais; cada interação aparece uma vez, na versão mais nova
+        """
+        history = self._load_history()
+        if self.archive:
+            # Interações que voltaram ao histórico principal valem pela versão de lá
+            hot_ids = {interaction["id"] for interaction in history if "id" in interaction}
+            yield from self.archive.iter_interactions(since, until, exclude=hot_ids)
+        for interaction in reversed(history):
+            timestamp = interaction.get("timestamp", "")
+            if (since and timestamp < since) or (until and timestamp > until):
+                continue
+            yield interaction
+    
+    def export_history(self, path: str, since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """
+        Exporta o histórico completo em streaming
+        Formato pela extensão: .jsonl, .jsonl.gz, .jsonl.zst ou .parquet
+        """
+        return (self.archive or HistoryArchive()).export(path, self.iter_all(since, until))
+    
+    def import_history(self, path: str) -> int:
+        """
+        Importa interações de um JSONL (comprimido ou não) para o arquivo
+        IDs já presentes no histórico principal ou no arquivo são ignorados
+        """
+        if not self.archive:
+            raise ValueError("Arquivo de histórico desabilitado (HISTORY_ARCHIVE_ENABLED)")
+        hot_ids = {interaction["id"] for interaction in self._load_history() if "id" in interaction}
+        return self.archive.import_file(path, skip_ids=hot_ids)
+    
     def clear_history(self):
         """Limpa todo o histórico"""
-        self._save_history([])
+        with self._locked():
+            self._save_history([])
 
@@ -0,0 +1,426 @@
+"""
+Arquivo de histórico em segmentos comprimidos
+Guarda as interações que saem do histórico principal e permite exportar/importar em streaming
+"""
+import gzip
+import io
+import json
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, IO
+import config
+
+try:
+    import zstandard
+except ImportError:  # Dependência opcional; sem ela os segmentos usam gzip
+    zstandard = None
+
+INDEX_FILE = "index.json"
+
+# Interações arquivadas que ainda não formam um lote, em JSONL sem compressão
+PENDING_FILE = "pending.jsonl"
+
+
+def _compress(data: bytes, extension: str) -> bytes:
+    """Comprime um bloco; blocos concatenados formam um segmento válido"""
+    if extension == ".zst":
+        return zstandard.ZstdCompressor(level=config.Config.HISTORY_ARCHIVE_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=min(9, config.Config.HISTORY_ARCHIVE_LEVEL))
+
+
+def _open_text(path: str) -> IO[str]:
+    """Abre um arquivo JSONL para leitura, comprimido ou não, conforme a extensão"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"Instale o pacote zstandard para ler {path}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _open_text_writer(path: str) -> IO[str]:
+    """Abre um arquivo JSONL para escrita, comprimido ou não, conforme a extensão"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"Instale o pacote zstandard para gravar {path}")
+        writer = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        return io.TextIOWrapper(writer, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+class HistoryArchive:
+    """
+    Arquivo de interações em segmentos JSONL comprimidos, somente de acréscimo
+    
+    As interações arquivadas se acumulam em um arquivo pendente sem compressão
+    e, a cada HISTORY_ARCHIVE_BATCH interações, o lote inteiro é comprimido em
+    um único bloco (zstd quando disponível, gzip caso contrário) e acrescentado
+    ao segmento atual, que é trocado ao passar de HISTORY_ARCHIVE_SEGMENT_MB.
+    Comprimir em lote evita um bloco por interação despejada, que ocupava bem
+    mais espaço. O índice guarda apenas a quantidade e o intervalo de timestamps
+    de cada segmento, para que consultas por período leiam só os segmentos
+    necessários; os IDs ficam em um arquivo ".ids" ao lado de cada segmento,
+    lido apenas na busca por ID e na remoção de duplicatas.
+    
+    Uma interação que volta ao histórico principal e é despejada de novo fica
+    arquivada mais de uma vez; leitura, contagem e exportação consideram apenas
+    a cópia mais nova.
+    """
+    
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or config.Config.HISTORY_ARCHIVE_DIR
+        self.extension = ".zst" if zstandard is not None else ".gz"
+        self.segment_max_bytes = config.Config.HISTORY_ARCHIVE_SEGMENT_MB * 1024 * 1024
+        self.batch_size = max(1, config.Config.HISTORY_ARCHIVE_BATCH)
+        self._lock = threading.Lock()
+        # count() é chamado a cada rerun: guarda o total junto com a versão do índice
+        self._count_cache: Optional[Tuple[Tuple[int, int], int]] = None
+    
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+    
+    @property
+    def pending_path(self) -> str:
+        return os.path.join(self.directory, PENDING_FILE)
+    
+    def _ids_path(self, name: str) -> str:
+        """Arquivo com os IDs do segmento (ou do pendente), um por linha"""
+        return os.path.join(self.directory, name + ".ids")
+    
+    def _append_ids(self, name: str, ids: List[str]):
+        if ids:
+            with open(self._ids_path(name), "a", encoding="utf-8") as f:
+                f.write("".join(f"{interaction_id}\n" for interaction_id in ids))
+    
+    def _read_id_list(self, name: str, entry: Dict) -> List[str]:
+        """
+        IDs do segmento na ordem de gravação, com repetições
+        Índices antigos ainda trazem a lista dentro da entrada
+        """
+        if "ids" in entry:
+            return list(entry["ids"])
+        try:
+            with open(self._ids_path(name), "r", encoding="utf-8") as f:
+                return [line.rstrip("\n") for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+    
+    def _read_ids(self, name: str, entry: Dict) -> Set[str]:
+        """IDs distintos do segmento"""
+        return set(self._read_id_list(name, entry))
+    
+    def _names(self, index: Dict[str, Dict]) -> List[str]:
+        """Segmentos e pendente, do mais antigo ao mais novo"""
+        # O pendente guarda as interações mais recentes e vem por último
+        return self._segments(index) + ([PENDING_FILE] if PENDING_FILE in index else [])
+    
+    def _latest_copies(self, index: Dict[str, Dict], names: List[str]) -> Dict[str, Tuple[int, int]]:
+        """
+        Posição da cópia mais nova de cada ID: (posição do segmento em names,
+        ocorrência do ID dentro do segmento, a partir de 1)
+        """
+        latest: Dict[str, Tuple[int, int]] = {}
+        for position, name in enumerate(names):
+            occurrences: Counter = Counter()
+            for interaction_id in self._read_id_list(name, index[name]):
+                occurrences[interaction_id] += 1
+                latest[interaction_id] = (position, occurrences[interaction_id])
+        return latest
+    
+    @staticmethod
+    def _segments(index: Dict[str, Dict]) -> List[str]:
+        """Segmentos comprimidos do índice, do mais antigo ao mais novo (sem o pendente)"""
+        return sorted(name for name in index if name != PENDING_FILE)
+    
+    def _load_index(self) -> Dict[str, Dict]:
+        """Carrega o índice de segmentos"""
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    
+    def _save_index(self, index: Dict[str, Dict]):
+        """Grava o índice de forma atômica"""
+        # Migra listas de IDs de índices antigos para os arquivos ".ids"
+        for name, entry in index.items():
+            if "ids" in entry:
+                self._append_ids(name, entry.pop("ids"))
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, self.index_path)
+    
+    def _current_segment(self, index: Dict[str, Dict]) -> str:
+        """Retorna o segmento que recebe novos blocos, criando outro se o atual estiver cheio"""
+        segments = self._segments(index)
+        if segments:
+            last = segments[-1]
+            path = os.path.join(self.directory, last)
+            if last.endswith(self.extension) and os.path.exists(path) and os.path.getsize(path) < self.segment_max_bytes:
+                return last
+        return f"segment-{len(segments) + 1:06d}.jsonl{self.extension}"
+    
+    def _update_entry(self, index: Dict[str, Dict], name: str, interactions: List[Dict]):
+        """Soma as interações às estatísticas do segmento (ou do pendente) no índice"""
+        timestamps = [i.get("timestamp", "") for i in interactions if i.get("timestamp")]
+        entry = index.setdefault(name, {"count": 0, "min_ts": None, "max_ts": None})
+        entry["count"] += len(interactions)
+        self._append_ids(name, [i["id"] for i in interactions if "id" in i])
+        if timestamps:
+            entry["min_ts"] = min(filter(None, [entry["min_ts"], *timestamps]))
+            entry["max_ts"] = max(filter(None, [entry["max_ts"], *timestamps]))
+    
+    def archive(self, interactions: List[Dict]):
+        """Acrescenta interações ao arquivo (ao pendente, até completar um lote)"""
+        if not interactions:
+            return
+        
+        data = "".join(
+            json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for interaction in interactions
+        )
+        
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            index = self._load_index()
+            
+            if PENDING_FILE not in index:
+                # Sobra de um flush interrompido depois de gravar o índice: já está no segmento
+                self._truncate_pending()
+            with open(self.pending_path, "a", encoding="utf-8") as f:
+                f.write(data)
+            self._update_entry(index, PENDING_FILE, interactions)
+            
+            if index[PENDING_FILE]["count"] >= self.batch_size:
+                self._flush_pending(index)
+            else:
+                self._save_index(index)
+    
+    def flush(self):
+        """Comprime as interações pendentes em um bloco, mesmo sem completar o lote"""
+        with self._lock:
+            index = self._load_index()
+            if index.get(PENDING_FILE, {}).get("count"):
+                self._flush_pending(index)
+    
+    def _flush_pending(self, index: Dict[str, Dict]):
+        """
+        Move o pendente para o segmento atual como um único bloco comprimido
+        O índice é gravado antes de esvaziar o pendente, para que uma
+        interrupção no meio não perca interações
+        """
+        with open(self.pending_path, "rb") as f:
+            data = f.read()
+        
+        segment = self._current_segment(index)
+        with open(os.path.join(self.directory, segment), "ab") as f:
+            f.write(_compress(data, self.extension))
+        
+        pending = index.pop(PENDING_FILE)
+        entry = index.setdefault(segment, {"count": 0, "min_ts": None, "max_ts": None})
+        entry["count"] += pending["count"]
+        # Mantém a ordem e as repetições: a remoção de duplicatas depende delas
+        self._append_ids(segment, self._read_id_list(PENDING_FILE, pending))
+        for key, pick in (("min_ts", min), ("max_ts", max)):
+            values = [v for v in (entry[key], pending[key]) if v]
+            entry[key] = pick(values) if values else None
+        self._save_index(index)
+        self._truncate_pending()
+    
+    def _truncate_pending(self):
+        """Esvazia o pendente e seus IDs"""
+        open(self.pending_path, "w").close()
+        open(self._ids_path(PENDING_FILE), "w").close()
+    
+    def iter_interactions(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        exclude: Optional[Set[str]] = None
+    ) -> Iterator[Dict]:
+        """
+        Percorre as interações arquivadas sem carregá-las todas na memória
+        
+        since/until são timestamps ISO; segmentos fora do intervalo nem são
+        abertos. Cada ID aparece uma única vez, na cópia mais nova (só os IDs
+        ficam na memória); IDs em exclude, como os do histórico principal, são
+        omitidos.
+        """
+        index = self._load_index()
+        names = self._names(index)
+        latest = self._latest_copies(index, names)
+        exclude = exclude or set()
+        for position, segment in enumerate(names):
+            entry = index[segment]
+            if since and entry.get("max_ts") and entry["max_ts"] < since:
+                continue
+            if until and entry.get("min_ts") and entry["min_ts"] > until:
+                continue
+            
+            occurrences: Counter = Counter()
+            with _open_text(os.path.join(self.directory, segment)) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    interaction = json.loads(line)
+                    interaction_id = interaction.get("id")
+                    if interaction_id is not None:
+                        if interaction_id in exclude:
+                            continue
+                        occurrences[interaction_id] += 1
+                        # Cópias antigas de uma interação arquivada de novo são ignoradas
+                        copy = latest.get(interaction_id)
+                        if copy is not None and copy != (position, occurrences[interaction_id]):
+                            continue
+                    timestamp = interaction.get("timestamp", "")
+                    if since and timestamp < since:
+                        continue
+                    if until and timestamp > until:
+                        continue
+                    yield interaction
+    
+    def get_interaction(self, interaction_id: str) -> Optional[Dict]:
+        """Busca uma interação arquivada, lendo apenas o segmento que a contém"""
+        index = self._load_index()
+        # Mais novos primeiro: uma interação arquivada de novo substitui a anterior
+        names = self._names(index)[::-1]
+        for segment in names:
+            if interaction_id not in self._read_ids(segment, index[segment]):
+                continue
+            found = None
+            with _open_text(os.path.join(self.directory, segment)) as f:
+                for line in f:
+                    if line.strip() and f'"{interaction_id}"' in line:
+                        interaction = json.loads(line)
+                        if interaction.get("id") == interaction_id:
+                            found = interaction
+            if found:
+                return found
+        return None
+    
+    def count(self) -> int:
+        """Quantidade de interações arquivadas, sem contar cópias antigas da mesma interação"""
+        try:
+            stat = os.stat(self.index_path)
+            # O índice é sempre substituído por os.replace: o inode muda a cada gravação
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return 0
+        if self._count_cache is None or self._count_cache[0] != version:
+            index = self._load_index()
+            total = 0
+            distinct: Set[str] = set()
+            for name, entry in index.items():
+                ids = self._read_id_list(name, entry)
+                # Interações sem ID contam uma vez cada; as com ID, uma vez por ID
+                total += entry.get("count", 0) - len(ids)
+                distinct.update(ids)
+            self._count_cache = (version, total + len(distinct))
+        return self._count_cache[1]
+    
+    def ids(self) -> Set[str]:
+        """IDs de todas as interações arquivadas"""
+        index = self._load_index()
+        return set().union(*(self._read_ids(name, entry) for name, entry in index.items()))
+    
+    def export(
+        self,
+        path: str,
+        interactions: Iterable[Dict],
+        batch_size: int = 1000
+    ) -> int:
+        """
+        Exporta interações em streaming para JSONL (.jsonl, .jsonl.gz, .jsonl.zst)
+        ou Parquet (.parquet, requer pyarrow). Retorna a quantidade exportada.
+        """
+        if path.endswith(".parquet"):
+            return self._export_parquet(path, interactions, batch_size)
+        
+        exported = 0
+        with _open_text_writer(path) as f:
+            for interaction in interactions:
+                f.write(json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n")
+                exported += 1
+        return exported
+    
+    @staticmethod
+    def _export_parquet(path: str, interactions: Iterable[Dict], batch_size: int) -> int:
+        """Exporta para Parquet em lotes; as mensagens vão como JSON em uma coluna de texto"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Instale o pacote pyarrow para exportar em Parquet")
+        
+        schema = pa.schema([
+            ("id", pa.string()),
+            ("timestamp", pa.string()),
+            ("provider", pa.string()),
+            ("model_type", pa.string()),
+            ("title", pa.string()),
+            ("messages", pa.string()),
+        ])
+        
+        def to_row(interaction: Dict) -> Dict:
+            row = {name: interaction.get(name) for name in schema.names}
+            row["messages"] = json.dumps(interaction.get("messages", []), ensure_ascii=False)
+            return row
+        
+        exported = 0
+        batch: List[Dict] = []
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for interaction in interactions:
+                batch.append(to_row(interaction))
+                if len(batch) >= batch_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    exported += len(batch)
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                exported += len(batch)
+        return exported
+    
+    def import_file(
+        self,
+        path: str,
+        batch_size: int = 1000,
+        skip_ids: Optional[Set[str]] = None
+    ) -> int:
+        """
+        Importa interações de um JSONL (comprimido ou não) para o arquivo, em lotes
+        
+        Interações cujo ID já está arquivado, aparece em skip_ids ou se repete no
+        próprio arquivo são ignoradas. Retorna a quantidade importada.
+        """
+        known = self.ids() | set(skip_ids or ())
+        imported = 0
+        batch: List[Dict] = []
+        with _open_text(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                interaction_id = interaction.get("id")
+                if interaction_id is not None:
+                    if interaction_id in known:
+                        continue
+                    known.add(interaction_id)
+                batch.append(interaction)
+                if len(batch) >= batch_size:
+                    self.archive(batch)
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            self.archive(batch)
+            imported += len(batch)
+        self.flush()
+        return imported
@@ -0,0 +1,99 @@
+"""
+Tabela de preços dos modelos
+Usada para estimar o custo de cada resposta a partir do uso de tokens
+"""
+from typing import Dict, Optional
+
+# Preço em USD por 1 milhão de tokens (entrada, saída)
+MODEL_PRICES: Dict[str, Dict[str, float]] = {
+    # OpenAI
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4": {"input": 30.00, "output": 60.00},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50},
+    # Anthropic
+    "claude-3-5-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-3-5-haiku": {"input": 0.80, "output": 4.00},
+    "claude-3-opus": {"input": 15.00, "output": 75.00},
+    "claude-3-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-3-haiku": {"input": 0.25, "output": 1.25},
+    # Amazon Titan
+    "amazon.titan-text-premier": {"input": 0.50, "output": 1.50},
+    "amazon.titan-text-express": {"input": 0.20, "output": 0.60},
+    "amazon.titan-text-lite": {"input": 0.15, "output": 0.20},
+}
+
+# Preço em USD por imagem gerada
+IMAGE_PRICES: Dict[str, float] = {
+    "dall-e-3": 0.040,
+}
+
+# Preço em USD por minuto de áudio transcrito
+AUDIO_PRICES: Dict[str, float] = {
+    "whisper-1": 0.006,
+}
+
+# Fração do preço de entrada cobrada pelo cache de prompt, por família de modelo:
+# leitura ("read") e gravação ("write") de tokens no cache
+CACHE_RATES: Dict[str, Dict[str, float]] = {
+    # OpenAI: desconto na leitura, gravação sem custo extra
+    "gpt-": {"read": 0.5, "write": 1.0},
+    # Anthropic (API direta ou Bedrock)
+    "claude": {"read": 0.1, "write": 1.25},
+}
+
+# Modelos sem cache de prompt conhecido: tokens em cache custam como entrada comum
+DEFAULT_CACHE_RATES: Dict[str, float] = {"read": 1.0, "write": 1.0}
+
+
+def get_model_price(model: str) -> Optional[Dict[str, float]]:
+    """
+    Retorna o preço do modelo
+    Aceita IDs com data/versão ou prefixo de provider (ex.: anthropic.claude-3-haiku-20240307-v1:0)
+    """
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    
+    # Procura o prefixo mais longo contido no ID do modelo
+    matches = [name for name in MODEL_PRICES if name in model]
+    if not matches:
+        return None
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+def get_cache_rates(model: str) -> Dict[str, float]:
+    """Retorna as frações de leitura e gravação de cache da família do modelo"""
+    matches = [name for name in CACHE_RATES if name in model]
+    if not matches:
+        return DEFAULT_CACHE_RATES
+    return CACHE_RATES[max(matches, key=len)]
+
+
+def estimate_cost(model: str, usage: Dict[str, float]) -> float:
+    """
+    Estima o custo em USD de uma resposta
+    Modelos sem preço conhecido (ex.: Ollama local) custam 0
+    
+    'input_tokens' não inclui os tokens lidos do cache ('cached_tokens') nem os
+    gravados nele ('cache_write_tokens')
+    """
+    if not usage:
+        return 0.0
+    
+    cost = 0.0
+    price = get_model_price(model)
+    if price:
+        cost += usage.get("input_tokens", 0) * price["input"] / 1_000_000
+        cache_rates = get_cache_rates(model)
+        cost += usage.get("cached_tokens", 0) * price["input"] * cache_rates["read"] / 1_000_000
+        cost += usage.get("cache_write_tokens", 0) * price["input"] * cache_rates["write"] / 1_000_000
+        cost += usage.get("output_tokens", 0) * price["output"] / 1_000_000
+    
+    if usage.get("images"):
+        cost += usage["images"] * IMAGE_PRICES.get(model, 0.0)
+    
+    if usage.get("audio_seconds"):
+        cost += usage["audio_seconds"] / 60 * AUDIO_PRICES.get(model, 0.0)
+    
+    return cost
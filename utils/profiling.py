@@ -0,0 +1,135 @@
+"""
+Perfilamento dos reruns do Streamlit
+Mede o tempo de cada fase do script e, opcionalmente, grava perfis dos reruns lentos em disco
+"""
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import config
+
+try:
+    import pyinstrument
+except ImportError:  # Dependência opcional; sem ela o modo "sampling" usa cProfile
+    pyinstrument = None
+
+# Nome da fase que agrupa o tempo não coberto por nenhuma fase medida
+UNTRACKED_PHASE = "outros"
+
+# Captura ativa por thread: st.stop()/st.rerun() interrompem o script antes de finish()
+_active = threading.local()
+
+
+class RerunProfiler:
+    """
+    Cronometra as fases de um rerun do script
+    
+    Cada trecho envolvido por phase(nome) soma seu tempo à fase; o restante do
+    rerun aparece como "outros". Com captura ligada ("cprofile" ou "sampling"),
+    o perfil da thread do rerun é gravado em PROFILE_DIR quando o rerun passa de
+    PROFILE_SLOW_RERUN_SECONDS. A captura cobre apenas a thread do script: o
+    trabalho feito em outras threads (single-flight, modo de comparação) aparece
+    só como espera. Desligado, phase() não faz nada além de ceder o controle.
+    """
+    
+    def __init__(self, enabled: bool, capture: Optional[str] = None):
+        self.enabled = enabled
+        self.capture = (capture or "").lower() if enabled else ""
+        self.phases: Dict[str, List[float]] = {}
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None
+        self.profile_path: Optional[str] = None
+        self._profiler = None
+    
+    def start(self):
+        """Inicia a medição do rerun e a captura do perfil, se configurada"""
+        if not self.enabled:
+            return
+        leftover = getattr(_active, "profiler", None)
+        if leftover is not None:
+            leftover._stop_capture()
+        self.started = time.perf_counter()
+        if self.capture == "sampling" and pyinstrument is not None:
+            self._profiler = pyinstrument.Profiler(async_mode="disabled")
+            self._profiler.start()
+            _active.profiler = self
+        elif self.capture in ("cprofile", "sampling"):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Outro rerun já está sendo perfilado (só um perfilador ativo por vez)
+                return
+            self._profiler = profiler
+            _active.profiler = self
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Soma à fase o tempo gasto dentro do bloco"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.setdefault(name, []).append(time.perf_counter() - started)
+    
+    def finish(self) -> Optional[float]:
+        """Encerra a medição, grava o perfil se o rerun foi lento e retorna a duração total"""
+        if not self.enabled or self.total is not None:
+            return self.total
+        self.total = time.perf_counter() - self.started
+        
+        if self._profiler is not None:
+            self._stop_capture()
+            if self.total >= config.Config.PROFILE_SLOW_RERUN_SECONDS:
+                self.profile_path = self._dump()
+            self._profiler = None
+        return self.total
+    
+    def _stop_capture(self):
+        """Para a captura do perfil (sem descartar o que foi coletado)"""
+        if pyinstrument is not None and isinstance(self._profiler, pyinstrument.Profiler):
+            if self._profiler.is_running:
+                self._profiler.stop()
+        elif self._profiler is not None:
+            self._profiler.disable()
+        if getattr(_active, "profiler", None) is self:
+            _active.profiler = None
+    
+    def _dump(self) -> Optional[str]:
+        """Grava o perfil capturado: .prof (cProfile, abrir com snakeviz) ou .html (pyinstrument)"""
+        os.makedirs(config.Config.PROFILE_DIR, exist_ok=True)
+        name = f"rerun-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{self.total:.2f}s"
+        try:
+            if pyinstrument is not None and isinstance(self._profiler, pyinstrument.Profiler):
+                path = os.path.join(config.Config.PROFILE_DIR, name + ".html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(self._profiler.output_html())
+            else:
+                path = os.path.join(config.Config.PROFILE_DIR, name + ".prof")
+                self._profiler.dump_stats(path)
+        except Exception as e:
+            print(f"Erro ao gravar perfil: {e}")
+            return None
+        return path
+    
+    def breakdown(self) -> List[Tuple[str, float, int, float]]:
+        """
+        Tempo por fase como (nome, segundos, chamadas, % do rerun), da mais lenta
+        para a mais rápida, incluindo o tempo fora das fases medidas
+        """
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        rows = [(name, sum(times), len(times)) for name, times in self.phases.items()]
+        untracked = total - sum(seconds for _, seconds, _ in rows)
+        if untracked > 0:
+            rows.append((UNTRACKED_PHASE, untracked, 1))
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return [
+            (name, seconds, count, seconds / total * 100 if total else 0.0)
+            for name, seconds, count in rows
+        ]
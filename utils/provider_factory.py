@@ -1,6 +1,7 @@
 """
 Factory para criar instâncias de providers
 """
+import threading
 from typing import Dict, Optional, List
 from providers import (
     OpenAIProvider,
@@ -15,6 +16,7 @@ class ProviderFactory:
     """Factory para gerenciar providers"""
     
     _providers: Dict[str, BaseProvider] = {}
+    _lock = threading.Lock()
     
     @classmethod
     def get_provider(cls, provider_name: str) -> Optional[BaseProvider]:
@@ -22,19 +24,22 @@ class ProviderFactory:
         Retorna uma instância do provider solicitado
         Cria uma nova instância se não existir
         """
-        provider_name_lower = provider_name.lower()
+        # Aceita tanto o nome exibido ("AWS Bedrock") quanto o identificador ("aws_bedrock")
+        provider_name_lower = provider_name.lower().replace(" ", "_")
         
-        if provider_name_lower not in cls._providers:
-            if provider_name_lower == "openai":
-                cls._providers[provider_name_lower] = OpenAIProvider()
-            elif provider_name_lower == "anthropic":
-                cls._providers[provider_name_lower] = AnthropicProvider()
-            elif provider_name_lower == "aws_bedrock" or provider_name_lower == "bedrock":
-                cls._providers[provider_name_lower] = BedrockProvider()
-            elif provider_name_lower == "ollama":
-                cls._providers[provider_name_lower] = OllamaProvider()
-            else:
-                return None
+        # O modo de comparação chama a factory a partir de várias threads
+        with cls._lock:
+            if provider_name_lower not in cls._providers:
+                if provider_name_lower == "openai":
+                    cls._providers[provider_name_lower] = OpenAIProvider()
+                elif provider_name_lower == "anthropic":
+                    cls._providers[provider_name_lower] = AnthropicProvider()
+                elif provider_name_lower == "aws_bedrock" or provider_name_lower == "bedrock":
+                    cls._providers[provider_name_lower] = BedrockProvider()
+                elif provider_name_lower == "ollama":
+                    cls._providers[provider_name_lower] = OllamaProvider()
+                else:
+                    return None
         
         return cls._providers.get(provider_name_lower)
     
@@ -0,0 +1,221 @@
+"""
+Armazenamento de estado de sessão no servidor
+Permite rodar várias réplicas do portal sem sessões fixas (sticky sessions)
+"""
+import json
+import sqlite3
+import threading
+import time
+import atexit
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Any
+import config
+
+
+class SessionStore(ABC):
+    """Interface para armazenamento do estado de sessões"""
+    
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retorna o estado da sessão ou None se não existir"""
+        pass
+    
+    @abstractmethod
+    def put(self, session_id: str, state: Dict[str, Any]):
+        """Grava o estado da sessão"""
+        pass
+    
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a sessão"""
+        pass
+    
+    def flush(self):
+        """Persiste gravações pendentes (apenas para stores com escrita adiada)"""
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Store em memória, para desenvolvimento (não compartilhado entre réplicas)"""
+    
+    def __init__(self):
+        self._sessions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._sessions.get(session_id)
+        return json.loads(state) if state is not None else None
+    
+    def put(self, session_id: str, state: Dict[str, Any]):
+        # Serializa para que o estado guardado não seja alterado pelo chamador
+        serialized = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._sessions[session_id] = serialized
+    
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store em arquivo SQLite, compartilhável por réplicas com volume em comum
+    
+    Sessões ociosas há mais de ttl segundos deixam de ser lidas e são apagadas
+    pelas gravações, no máximo uma vez por PURGE_INTERVAL (ttl 0 = sem expiração).
+    """
+    
+    PURGE_INTERVAL = 60.0
+    
+    def __init__(self, path: str, ttl: int = 0):
+        self.path = path
+        self.ttl = ttl
+        self._last_purge = 0.0
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Retorna a conexão da thread atual (conexões SQLite não são compartilháveis)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+    
+    def _expired_before(self, now: float) -> float:
+        """Instante antes do qual uma sessão está expirada"""
+        return now - self.ttl if self.ttl > 0 else float("-inf")
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT state FROM sessions WHERE id = ? AND updated_at >= ?",
+            (session_id, self._expired_before(time.time()))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def put(self, session_id: str, state: Dict[str, Any]):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO sessions (id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (session_id, json.dumps(state, ensure_ascii=False), now)
+        )
+        if self.ttl > 0 and now - self._last_purge >= self.PURGE_INTERVAL:
+            self._last_purge = now
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (self._expired_before(now),))
+        conn.commit()
+    
+    def delete(self, session_id: str):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        conn.commit()
+
+
+class RedisSessionStore(SessionStore):
+    """Store em Redis (ou servidor compatível), com expiração das sessões ociosas"""
+    
+    def __init__(self, url: str, ttl: int):
+        import redis  # Dependência opcional, necessária apenas para este store
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+    
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"ebrain:session:{session_id}"
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        state = self.client.get(self._key(session_id))
+        return json.loads(state) if state is not None else None
+    
+    def put(self, session_id: str, state: Dict[str, Any]):
+        self.client.set(
+            self._key(session_id),
+            json.dumps(state, ensure_ascii=False),
+            ex=self.ttl or None
+        )
+    
+    def delete(self, session_id: str):
+        self.client.delete(self._key(session_id))
+
+
+class WriteBehindSessionStore(SessionStore):
+    """
+    Adia as gravações para uma thread em segundo plano
+    
+    O rerun do Streamlit não espera o armazenamento: put() apenas marca a sessão
+    como pendente e a thread grava o estado mais recente a cada intervalo.
+    Leituras consultam primeiro as gravações pendentes.
+    """
+    
+    def __init__(self, backend: SessionStore, interval: float):
+        self.backend = backend
+        self.interval = interval
+        self._pending: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if session_id in self._pending:
+                return self._pending[session_id]
+        return self.backend.get(session_id)
+    
+    def put(self, session_id: str, state: Dict[str, Any]):
+        # Cópia via JSON para isolar o estado pendente de alterações posteriores
+        snapshot = json.loads(json.dumps(state, ensure_ascii=False))
+        with self._lock:
+            self._pending[session_id] = snapshot
+    
+    def delete(self, session_id: str):
+        with self._lock:
+            self._pending[session_id] = None
+    
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for session_id, state in pending.items():
+            try:
+                if state is None:
+                    self.backend.delete(session_id)
+                else:
+                    self.backend.put(session_id, state)
+            except Exception as e:
+                print(f"Erro ao gravar sessão {session_id}: {e}")
+                # Devolve para a próxima rodada, a menos que já exista versão mais nova
+                with self._lock:
+                    self._pending.setdefault(session_id, state)
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def create_session_store() -> SessionStore:
+    """Cria o store configurado em SESSION_STORE (memory, sqlite ou redis)"""
+    backend_name = config.Config.SESSION_STORE.lower()
+    
+    if backend_name == "memory":
+        # Em memória não há custo de gravação a adiar
+        return InMemorySessionStore()
+    
+    if backend_name == "sqlite":
+        backend: SessionStore = SQLiteSessionStore(config.Config.SESSION_STORE_PATH, config.Config.SESSION_TTL)
+    elif backend_name == "redis":
+        backend = RedisSessionStore(config.Config.SESSION_REDIS_URL, config.Config.SESSION_TTL)
+    else:
+        raise ValueError(f"SESSION_STORE desconhecido: {config.Config.SESSION_STORE}")
+    
+    if config.Config.SESSION_WRITE_BEHIND_INTERVAL > 0:
+        return WriteBehindSessionStore(backend, config.Config.SESSION_WRITE_BEHIND_INTERVAL)
+    return backend
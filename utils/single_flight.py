@@ -0,0 +1,231 @@
+"""
+Coalescência de requisições idênticas em andamento (single-flight)
+Quando várias sessões enviam o mesmo prompt ao mesmo tempo, o upstream é chamado uma única vez
+"""
+import hashlib
+import json
+import threading
+from typing import List, Dict, Any, Callable, Iterator, Optional
+from providers.base import BaseProvider, Message, ModelType
+from providers import resilience
+import config
+
+
+def request_key(
+    provider: BaseProvider,
+    messages: List[Message],
+    model_type: ModelType,
+    model: Optional[str] = None
+) -> str:
+    """
+    Chave da requisição: provider, modelo, tipo de modelo, prompt de sistema e mensagens
+    O modelo é o efetivo: sem modelo informado, vale o padrão configurado do provider
+    """
+    payload = json.dumps(
+        [
+            provider.provider_name,
+            provider.resolve_model(model),
+            model_type.value,
+            provider.get_system_prompt(model_type),
+            [[msg.role, msg.content] for msg in messages],
+        ],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _fresh_error(error: Exception, provider_name: str) -> Exception:
+    """
+    Cópia do erro do voo para uma sessão, do mesmo tipo e com os mesmos atributos
+    
+    Levantar o mesmo objeto em várias threads mistura o traceback e o contexto
+    de cada uma; tipos que não podem ser copiados viram um ProviderError.
+    """
+    try:
+        fresh = type(error).__new__(type(error))
+        fresh.args = error.args
+        if hasattr(error, "__dict__"):
+            fresh.__dict__.update(error.__dict__)
+        return fresh
+    except Exception:
+        return resilience.ProviderError(str(error), provider_name, retryable=resilience.is_retryable(error))
+
+
+class _Flight:
+    """Requisição em andamento: deltas recebidos até agora e o desfecho"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.deltas: List[str] = []
+        self.done = False
+        self.response: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+
+
+class SingleFlight:
+    """
+    Executa cada requisição idêntica uma única vez e repassa o resultado a todos
+    
+    A primeira chamada abre o voo e dispara o streaming do provider em uma
+    thread própria; chamadas com a mesma chave que chegam enquanto ele está em
+    andamento apenas se inscrevem. Todos recebem os deltas desde o início (os já
+    emitidos são reproduzidos) e a mesma resposta final ou uma cópia do erro. Como a
+    thread não depende de quem abriu o voo, uma sessão que abandona a leitura
+    não deixa as demais esperando, e o callback on_response de quem abriu o voo
+    é chamado pela própria thread, uma única vez, mesmo que essa sessão tenha
+    sido interrompida. Cada sessão espera no máximo até o seu próprio deadline.
+    O voo é descartado ao terminar: respostas não ficam em cache.
+    """
+    
+    _instance: Optional["SingleFlight"] = None
+    _instance_lock = threading.Lock()
+    
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+    
+    @classmethod
+    def shared(cls) -> "SingleFlight":
+        """Retorna a instância compartilhada pelo processo"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    
+    def stream(
+        self,
+        provider: BaseProvider,
+        messages: List[Message],
+        model_type: ModelType,
+        on_response: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Mesmo contrato de BaseProvider.stream_completion, com coalescência
+        
+        on_response(resposta) é chamado uma vez por chamada ao upstream (use-o para
+        contabilizar o uso); quem se junta a um voo já aberto não o dispara, e a
+        resposta final que recebe traz "coalesced": True.
+        
+        Raises:
+            DeadlineExceededError: se o deadline da sessão acabar antes da resposta
+        """
+        deadline = kwargs["deadline"] = resilience.Deadline.coerce(kwargs.get("deadline"))
+        
+        if not config.Config.SINGLE_FLIGHT_ENABLED:
+            for event in provider.stream_completion(messages, model_type, **kwargs):
+                if event.get("done"):
+                    self._notify(on_response, event["response"])
+                yield event
+            return
+        
+        key = request_key(provider, messages, model_type, kwargs.get("model"))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        
+        if leader:
+            threading.Thread(
+                target=self._run,
+                args=(key, flight, provider, messages, model_type, on_response, kwargs),
+                name="single-flight",
+                daemon=True
+            ).start()
+        
+        sent = 0
+        while True:
+            with flight.condition:
+                while sent == len(flight.deltas) and not flight.done:
+                    # Quem se juntou ao voo não espera além do próprio deadline
+                    if deadline.expired:
+                        raise resilience.DeadlineExceededError(provider.provider_name, deadline.seconds)
+                    flight.condition.wait(timeout=deadline.remaining())
+                deltas = flight.deltas[sent:]
+                done = flight.done
+            
+            for delta in deltas:
+                yield {"delta": delta}
+            sent += len(deltas)
+            
+            if done and sent == len(flight.deltas):
+                break
+        
+        if flight.error is not None:
+            raise _fresh_error(flight.error, provider.provider_name) from flight.error
+        
+        # Cópia rasa: cada sessão pode alterar a sua resposta sem afetar as outras
+        response = dict(flight.response or {})
+        if not leader:
+            response["coalesced"] = True
+        yield {"done": True, "response": response}
+    
+    def chat_completion(
+        self,
+        provider: BaseProvider,
+        messages: List[Message],
+        model_type: ModelType,
+        on_response: Optional[Callable[[Dict[str, Any]], None]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Mesmo contrato de BaseProvider.chat_completion, com coalescência (veja stream)"""
+        if not config.Config.SINGLE_FLIGHT_ENABLED:
+            response = provider.chat_completion(messages, model_type, **kwargs)
+            self._notify(on_response, response)
+            return response
+        
+        response: Dict[str, Any] = {}
+        for event in self.stream(provider, messages, model_type, on_response, **kwargs):
+            if event.get("done"):
+                response = event["response"]
+        return response
+    
+    @staticmethod
+    def _notify(on_response: Optional[Callable[[Dict[str, Any]], None]], response: Dict[str, Any]):
+        """Chama on_response sem deixar uma falha nele afetar quem espera a resposta"""
+        if on_response is None:
+            return
+        try:
+            on_response(response)
+        except Exception as e:
+            print(f"Erro ao processar resposta: {e}")
+    
+    def in_flight(self) -> int:
+        """Quantidade de requisições distintas em andamento"""
+        with self._lock:
+            return len(self._flights)
+    
+    def _run(
+        self,
+        key: str,
+        flight: _Flight,
+        provider: BaseProvider,
+        messages: List[Message],
+        model_type: ModelType,
+        on_response: Optional[Callable[[Dict[str, Any]], None]],
+        kwargs: Dict[str, Any]
+    ):
+        """Executa o streaming no upstream, publicando cada evento para os inscritos"""
+        try:
+            for event in provider.stream_completion(messages, model_type, **kwargs):
+                if event.get("delta"):
+                    with flight.condition:
+                        flight.deltas.append(event["delta"])
+                        flight.condition.notify_all()
+                if event.get("done"):
+                    flight.response = event["response"]
+                    self._notify(on_response, flight.response)
+        except Exception as e:
+            flight.error = e
+        finally:
+            # Sai do registro antes de sinalizar o fim: quem chegar depois abre um novo voo
+            with self._lock:
+                self._flights.pop(key, None)
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
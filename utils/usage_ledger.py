@@ -0,0 +1,366 @@
+"""
+Contabilização de uso e custo por usuário, time, provider e tipo de modelo
+Aplica cotas e troca para um modelo mais barato quando o orçamento aperta
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from providers.base import BaseProvider, Message, ModelType
+from utils.pricing import estimate_cost
+import config
+
+# Janelas de agregação: nome -> (duração, tamanho do bucket), em segundos
+WINDOWS: Dict[str, Tuple[int, int]] = {
+    "day": (24 * 3600, 60),
+    "month": (30 * 24 * 3600, 3600),
+}
+
+# Campos de uso registrados no ledger
+USAGE_FIELDS = (
+    "input_tokens", "cached_tokens", "cache_write_tokens", "output_tokens", "images", "audio_seconds"
+)
+
+# Dimensões pelas quais o gasto é agregado
+Scope = Tuple[str, str]
+
+
+class QuotaExceededError(ValueError):
+    """O orçamento do usuário ou do time foi esgotado"""
+    def __init__(self, scope: Scope, window: str, spent: float, limit: float):
+        self.scope = scope
+        self.window = window
+        self.spent = spent
+        self.limit = limit
+        super().__init__(
+            f"Orçamento esgotado para {scope[0]} '{scope[1]}' "
+            f"({window}: US$ {spent:.2f} de US$ {limit:.2f})"
+        )
+
+
+class RollingCounter:
+    """
+    Soma em janela deslizante, agrupada em buckets de tamanho fixo
+    
+    Adição e leitura custam O(buckets expirados), sem varrer o histórico. O
+    bucket que contém o início da janela conta inteiro: o total pode incluir
+    até um bucket a mais, mas nunca deixa gasto da janela de fora.
+    """
+    
+    def __init__(self, window: int, bucket: int):
+        self.window = window
+        self.bucket = bucket
+        self._buckets: Dict[int, float] = {}
+        self._total = 0.0
+    
+    def add(self, value: float, timestamp: Optional[float] = None):
+        key = int((timestamp if timestamp is not None else time.time()) // self.bucket)
+        self._buckets[key] = self._buckets.get(key, 0.0) + value
+        self._total += value
+    
+    def total(self, now: Optional[float] = None) -> float:
+        oldest = int(((now if now is not None else time.time()) - self.window) // self.bucket)
+        for key in [k for k in self._buckets if k < oldest]:
+            self._total -= self._buckets.pop(key)
+        return max(0.0, self._total)
+
+
+class UsageLedger:
+    """
+    Ledger de uso persistido em SQLite com contadores em memória
+    
+    Cada resposta vira uma linha no SQLite; os contadores em janela deslizante
+    respondem às consultas de cota sem tocar o disco e são reconstruídos a
+    partir do banco a cada USAGE_SYNC_INTERVAL, o que inclui o gasto feito
+    por outras réplicas que compartilham o mesmo arquivo.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.Config.USAGE_DB_PATH
+        self.budgets: Dict[str, Dict[str, float]] = config.Config.USAGE_BUDGETS
+        self.downgrade_models: Dict[str, str] = config.Config.USAGE_DOWNGRADE_MODELS
+        self.downgrade_threshold = config.Config.USAGE_DOWNGRADE_THRESHOLD
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters: Dict[Tuple[Scope, str], RollingCounter] = {}
+        self._synced_at = 0.0
+        
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "timestamp REAL NOT NULL, user TEXT NOT NULL, team TEXT NOT NULL, "
+            "provider TEXT NOT NULL, model TEXT NOT NULL, model_type TEXT NOT NULL, "
+            "input_tokens INTEGER NOT NULL DEFAULT 0, cached_tokens INTEGER NOT NULL DEFAULT 0, "
+            "cache_write_tokens INTEGER NOT NULL DEFAULT 0, output_tokens INTEGER NOT NULL DEFAULT 0, images INTEGER NOT NULL DEFAULT 0, "
+            "audio_seconds REAL NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0)"
+        )
+        # Bancos criados antes do registro de gravações em cache
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(usage)")}
+        if "cache_write_tokens" not in columns:
+            conn.execute("ALTER TABLE usage ADD COLUMN cache_write_tokens INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_timestamp ON usage (timestamp)")
+        conn.commit()
+        self._sync()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Retorna a conexão da thread atual"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def _scopes(user: str, team: str, provider: str, model_type: str) -> List[Scope]:
+        return [
+            ("global", "*"),
+            ("user", user),
+            ("team", team),
+            ("provider", provider),
+            ("model_type", model_type),
+        ]
+    
+    @staticmethod
+    def _add(
+        counters: Dict[Tuple[Scope, str], RollingCounter],
+        scope: Scope,
+        window: str,
+        cost: float,
+        timestamp: float
+    ):
+        """Soma o custo no contador do escopo na janela"""
+        counter = counters.get((scope, window))
+        if counter is None:
+            duration, bucket = WINDOWS[window]
+            counter = counters[(scope, window)] = RollingCounter(duration, bucket)
+        counter.add(cost, timestamp)
+    
+    def _sync(self):
+        """Reconstrói os contadores a partir do banco, já agregado no tamanho de cada bucket"""
+        counters: Dict[Tuple[Scope, str], RollingCounter] = {}
+        conn = self._connection()
+        for window, (duration, bucket) in WINDOWS.items():
+            rows = conn.execute(
+                "SELECT CAST(timestamp / ? AS INTEGER) * ?, user, team, provider, model_type, SUM(cost) "
+                "FROM usage WHERE timestamp >= ? "
+                "GROUP BY 1, user, team, provider, model_type",
+                (bucket, bucket, time.time() - duration)
+            ).fetchall()
+            for timestamp, user, team, provider, model_type, cost in rows:
+                for scope in self._scopes(user, team, provider, model_type):
+                    self._add(counters, scope, window, cost, timestamp)
+        
+        with self._lock:
+            self._counters = counters
+            self._synced_at = time.monotonic()
+    
+    def _maybe_sync(self):
+        if time.monotonic() - self._synced_at >= config.Config.USAGE_SYNC_INTERVAL:
+            self._sync()
+    
+    def record(
+        self,
+        user: str,
+        team: str,
+        provider: str,
+        model: str,
+        model_type: str,
+        usage: Dict[str, float]
+    ) -> float:
+        """Registra o uso de uma resposta e retorna o custo estimado em USD"""
+        usage = usage or {}
+        cost = estimate_cost(model, usage)
+        timestamp = time.time()
+        
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO usage (timestamp, user, team, provider, model, model_type, "
+            f"{', '.join(USAGE_FIELDS)}, cost) "
+            f"VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' for _ in USAGE_FIELDS)}, ?)",
+            (timestamp, user, team, provider, model, model_type,
+             *(usage.get(field, 0) for field in USAGE_FIELDS), cost)
+        )
+        conn.commit()
+        
+        with self._lock:
+            for scope in self._scopes(user, team, provider, model_type):
+                for window in WINDOWS:
+                    self._add(self._counters, scope, window, cost, timestamp)
+        return cost
+    
+    def spend(self, scope: Scope, window: str) -> float:
+        """Gasto em USD do escopo na janela ('day' ou 'month')"""
+        self._maybe_sync()
+        with self._lock:
+            counter = self._counters.get((scope, window))
+            return counter.total() if counter else 0.0
+    
+    def _budgets_for(self, scope: Scope) -> Dict[str, float]:
+        """Orçamentos do escopo: específico ("user:ana") ou padrão ("user:*")"""
+        kind, name = scope
+        return self.budgets.get(f"{kind}:{name}") or self.budgets.get(f"{kind}:*", {})
+    
+    def budget_usage(self, user: str, team: str) -> Optional[Tuple[float, Scope, str, float, float]]:
+        """
+        Retorna o orçamento mais comprometido do usuário/time
+        como (fração usada, escopo, janela, gasto, limite), ou None sem orçamentos
+        """
+        worst = None
+        for scope in [("user", user), ("team", team)]:
+            for window, limit in self._budgets_for(scope).items():
+                if window not in WINDOWS or limit <= 0:
+                    continue
+                spent = self.spend(scope, window)
+                ratio = spent / limit
+                if worst is None or ratio > worst[0]:
+                    worst = (ratio, scope, window, spent, limit)
+        return worst
+    
+    def check_quota(self, user: str, team: str):
+        """Lança QuotaExceededError se algum orçamento do usuário/time estiver esgotado"""
+        worst = self.budget_usage(user, team)
+        if worst and worst[0] >= 1.0:
+            _, scope, window, spent, limit = worst
+            raise QuotaExceededError(scope, window, spent, limit)
+    
+    def resolve_model(self, provider: str, user: str, team: str) -> Optional[str]:
+        """
+        Verifica a cota e escolhe o modelo a usar
+        
+        Retorna o modelo mais barato configurado para o provider quando o gasto
+        passa de USAGE_DOWNGRADE_THRESHOLD do orçamento, ou None para manter o
+        modelo padrão.
+        
+        Raises:
+            QuotaExceededError: se o orçamento estiver esgotado
+        """
+        self.check_quota(user, team)
+        worst = self.budget_usage(user, team)
+        if worst and worst[0] >= self.downgrade_threshold:
+            return self.downgrade_models.get(provider)
+        return None
+    
+    def summary(self, user: str, team: str) -> Dict[str, Dict[str, float]]:
+        """Gasto do usuário e do time em cada janela, para exibição"""
+        return {
+            window: {
+                "user": self.spend(("user", user), window),
+                "team": self.spend(("team", team), window),
+            }
+            for window in WINDOWS
+        }
+    
+    def totals(self, since: float, group_by: str = "provider") -> Dict[str, Dict[str, float]]:
+        """Totais de uso e custo desde o timestamp informado, agrupados por uma dimensão"""
+        if group_by not in ("user", "team", "provider", "model", "model_type"):
+            raise ValueError(f"Agrupamento inválido: {group_by}")
+        columns = ", ".join(f"SUM({field})" for field in USAGE_FIELDS)
+        rows = self._connection().execute(
+            f"SELECT {group_by}, {columns}, SUM(cost) FROM usage "
+            f"WHERE timestamp >= ? GROUP BY {group_by}",
+            (since,)
+        ).fetchall()
+        
+        totals: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for key, *values in rows:
+            totals[key] = dict(zip(USAGE_FIELDS + ("cost",), values))
+        return dict(totals)
+
+
+
+class MeteredProvider(BaseProvider):
+    """
+    Provider que contabiliza o uso no ledger a cada chamada ao upstream
+    
+    Envolve outro provider e registra no UsageLedger, em nome do usuário e do
+    time informados, o uso de cada resposta de chat_completion,
+    stream_completion e structured_completion (cada tentativa de correção
+    conta). A cota é verificada antes de cada chamada. É a forma de usar os
+    providers fora da interface com o uso contabilizado:
+    
+        provider = MeteredProvider(ProviderFactory.get_provider("OpenAI"), ledger, "ana", "dados")
+        provider.structured_completion(messages, ModelType.SUMMARIZATION, schema)
+    
+    Com SingleFlight, o registro acontece na thread do voo, uma vez por
+    chamada ao upstream, mesmo que a sessão que abriu o voo seja interrompida.
+    
+    Raises:
+        QuotaExceededError: se o orçamento do usuário ou do time estiver esgotado
+    """
+    
+    def __init__(self, provider: BaseProvider, ledger: UsageLedger, user: str, team: str):
+        super().__init__(provider.provider_name)
+        self.provider = provider
+        self.ledger = ledger
+        self.user = user
+        self.team = team
+    
+    def is_available(self) -> bool:
+        return self.provider.is_available()
+    
+    def list_models(self) -> List[str]:
+        return self.provider.list_models()
+    
+    def list_chat_models(self) -> List[str]:
+        return self.provider.list_chat_models()
+    
+    def default_model(self) -> str:
+        return self.provider.default_model()
+    
+    def get_system_prompt(self, model_type: ModelType) -> str:
+        return self.provider.get_system_prompt(model_type)
+    
+    def get_max_tokens(self, model_type: ModelType) -> int:
+        return self.provider.get_max_tokens(model_type)
+    
+    def chat_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Dict[str, Any]:
+        self.ledger.check_quota(self.user, self.team)
+        response = self.provider.chat_completion(messages, model_type, **kwargs)
+        self._record(response, model_type, kwargs.get("model"))
+        return response
+    
+    def stream_completion(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        self.ledger.check_quota(self.user, self.team)
+        for event in self.provider.stream_completion(messages, model_type, **kwargs):
+            if event.get("done"):
+                self._record(event["response"], model_type, kwargs.get("model"))
+            yield event
+    
+    def _structured_request(
+        self,
+        messages: List[Message],
+        model_type: ModelType,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Dict[str, Any]:
+        # structured_completion (da classe base) chama este método a cada tentativa
+        self.ledger.check_quota(self.user, self.team)
+        response = self.provider._structured_request(messages, model_type, schema, **kwargs)
+        self._record(response, model_type, kwargs.get("model"))
+        return response
+    
+    def _record(self, response: Dict[str, Any], model_type: ModelType, model: Optional[str]):
+        """Registra o uso da resposta sem deixar uma falha no ledger afetar quem a espera"""
+        try:
+            self.ledger.record(
+                self.user,
+                self.team,
+                self.provider_name,
+                response.get("model") or self.resolve_model(model),
+                model_type.value,
+                response.get("usage", {})
+            )
+        except Exception as e:
+            print(f"Erro ao registrar uso: {e}")